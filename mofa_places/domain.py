@@ -0,0 +1,30 @@
+from collections import namedtuple
+
+
+# Departure of a station board, tuple-backed to keep cached boards small.
+# These are the keys of the services returned for rail-departures:
+#   departure   scheduled time (ISO 8601, e.g. "2013-05-23T12:02:00+0200")
+#   delay       delay in minutes, None if unknown
+#   platform    platform, None if unknown
+#   category    category of the train (IC, IR, S...)
+#   number      number of the train or line
+#   to          terminus
+#   operator    operator, "unknown" if not given
+Departure = namedtuple('Departure', ['departure', 'delay', 'platform', 'category',
+                                     'number', 'to', 'operator'])
+
+
+class Station(object):
+    """ SBB station """
+
+    def __init__(self, id=None, name=None, x=None, y=None):
+        self.id = id
+        self.name = name
+        self.x = x      # longitude
+        self.y = y      # latitude
+
+    def as_dict(self):
+        return {'id': self.id,
+                'name': self.name,
+                'x': self.x,
+                'y': self.y}
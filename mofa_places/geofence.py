@@ -0,0 +1,257 @@
+import hashlib
+import logging
+import os.path
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+
+from mofa_places.importers.cache import replace
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+CONTOUR_CH = os.path.join(os.path.dirname(__file__), "importers", "resources", "contour_ch_wgs84.txt")
+# directory of the indexes built at runtime (the package may be read only),
+# shared by the workers of a host
+CACHE_DIR = os.environ.get('MOFA_PLACES_CACHE_DIR',
+                           os.path.join(tempfile.gettempdir(), 'mofa_places'))
+
+
+class Polygon(object):
+    """ Polygon of (longitude, latitude) vertices
+
+    contains_points classifies many points at once, with NumPy when it is
+    installed, with a PolygonIndex otherwise.
+    """
+
+    def __init__(self):
+        self.vertices = []
+        self._arrays = None
+        self._index = None
+
+    def load_from_file(self, f):
+        """ Load vertices from a file of "x,y" lines """
+        with open(f) as lines:
+            for line in lines:
+                line = line.strip()
+                if line:
+                    x, y = line.split(',')
+                    self.vertices.append({'x': float(x), 'y': float(y)})
+        self._arrays = None
+        self._index = None
+
+    @property
+    def bounds(self):
+        """ (min x, min y, max x, max y) """
+        xs = [v['x'] for v in self.vertices]
+        ys = [v['y'] for v in self.vertices]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def contains_point(self, point):
+        px = point['x']
+        py = point['y']
+
+        inPolygon = False
+        j = len(self.vertices) - 1
+        for i, v in enumerate(self.vertices):
+            v1x = v['x']
+            v1y = v['y']
+            v2x = self.vertices[j]['x']
+            v2y = self.vertices[j]['y']
+
+            if (((v1y > py) != (v2y > py)) and (px < (v2x - v1x) * (py - v1y) / (v2y - v1y) + v1x)):
+                inPolygon = not inPolygon
+
+            j = i
+
+        return inPolygon
+
+    def contains_points(self, xs, ys):
+        """ Classify points given as sequences of x and y coordinates
+
+        With NumPy, points outside the bounding box of the polygon are
+        rejected before running the ray casting test on the others.
+
+        :return: list of booleans, True for the points inside the polygon
+        """
+        if numpy is None:
+            return self.index().contains_points(xs, ys)
+
+        px = numpy.asarray(xs, dtype=float)
+        py = numpy.asarray(ys, dtype=float)
+        v1x, v1y, v2x, v2y, bounds = self.arrays()
+        minx, miny, maxx, maxy = bounds
+        inside = (px >= minx) & (px <= maxx) & (py >= miny) & (py <= maxy)
+        candidates = numpy.nonzero(inside)[0]
+        cx = px[candidates]
+        cy = py[candidates]
+        result = numpy.zeros(len(candidates), dtype=bool)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            for i in range(len(v1x)):
+                crossing = (v1y[i] > cy) != (v2y[i] > cy)
+                crossing &= cx < (v2x[i] - v1x[i]) * (cy - v1y[i]) / (v2y[i] - v1y[i]) + v1x[i]
+                result ^= crossing
+        inside[candidates] = result
+        return inside.tolist()
+
+    def index(self):
+        if self._index is None:
+            self._index = PolygonIndex.from_polygon(self)
+        return self._index
+
+    def arrays(self):
+        """ Edges (vertex i and vertex i - 1) as NumPy arrays, and bounds """
+        if self._arrays is None:
+            v1x = numpy.array([v['x'] for v in self.vertices], dtype=float)
+            v1y = numpy.array([v['y'] for v in self.vertices], dtype=float)
+            self._arrays = (v1x, v1y, numpy.roll(v1x, 1), numpy.roll(v1y, 1), self.bounds)
+        return self._arrays
+
+
+class PolygonIndex(object):
+    """ Slab decomposition of the edges of a polygon
+
+    The plane is cut in horizontal slabs at the y coordinate of every
+    vertex, each slab keeps the edges crossing it ordered by x. A
+    containment test finds the slab with a binary search then counts the
+    edges right of the point with another one: O(log n) instead of
+    testing every edge. Results are the same as Polygon.contains_point.
+    """
+
+    MAGIC = b'MPIDX001'
+
+    def __init__(self, ys, offsets, edges, source=b''):
+        self.ys = ys                # array of slab limits
+        self.offsets = offsets      # edges of slab k: offsets[k] to offsets[k + 1]
+        self.edges = edges          # array of x1, y1, x2, y2 for each edge of each slab
+        self.source = source        # hash of the vertices the index was built from
+
+    @classmethod
+    def from_polygon(cls, polygon, source=b''):
+        vertices = [(v['x'], v['y']) for v in polygon.vertices]
+        ys = sorted(set(y for x, y in vertices))
+        slabs = [[] for _ in range(len(ys) - 1)]
+        for i, (x1, y1) in enumerate(vertices):
+            x2, y2 = vertices[i - 1]
+            if y1 == y2:
+                continue
+            first = bisect_left(ys, min(y1, y2))
+            last = bisect_left(ys, max(y1, y2))
+            for k in range(first, last):
+                slabs[k].append((x1, y1, x2, y2))
+        offsets = array('i', [0])
+        edges = array('d')
+        for k, slab in enumerate(slabs):
+            middle = (ys[k] + ys[k + 1]) / 2
+            slab.sort(key=lambda e: (e[2] - e[0]) * (middle - e[1]) / (e[3] - e[1]) + e[0])
+            for edge in slab:
+                edges.extend(edge)
+            offsets.append(len(edges) // 4)
+        return cls(array('d', ys), offsets, edges, source)
+
+    def contains(self, px, py):
+        ys = self.ys
+        k = bisect_right(ys, py) - 1
+        if k < 0 or k >= len(ys) - 1:
+            return False
+        edges = self.edges
+        lo = self.offsets[k]
+        end = hi = self.offsets[k + 1]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            v1x, v1y, v2x, v2y = edges[4 * mid:4 * mid + 4]
+            if px < (v2x - v1x) * (py - v1y) / (v2y - v1y) + v1x:
+                hi = mid
+            else:
+                lo = mid + 1
+        # parity of the number of edges right of the point
+        return (end - lo) % 2 == 1
+
+    def contains_points(self, xs, ys):
+        return [self.contains(x, y) for x, y in zip(xs, ys)]
+
+    def save(self, path):
+        """ Write the index to a binary file (atomically) """
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.MAGIC)
+                f.write(struct.pack('<20siii', self.source, len(self.ys),
+                                    len(self.offsets), len(self.edges)))
+                self.ys.tofile(f)
+                self.offsets.tofile(f)
+                self.edges.tofile(f)
+            replace(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError("%s is not a polygon index" % path)
+            source, nys, noffsets, nedges = struct.unpack('<20siii', f.read(32))
+            ys = array('d')
+            ys.fromfile(f, nys)
+            offsets = array('i')
+            offsets.fromfile(f, noffsets)
+            edges = array('d')
+            edges.fromfile(f, nedges)
+        return cls(ys, offsets, edges, source)
+
+
+def swiss_contour():
+    """ Polygon of the contour of Switzerland """
+    polygon = Polygon()
+    polygon.load_from_file(CONTOUR_CH)
+    return polygon
+
+
+def load_index(vertices_file, path):
+    """ Load the index of the polygon of vertices_file cached in path,
+    build and cache it if it is missing or was built from another file
+    """
+    with open(vertices_file, 'rb') as f:
+        source = hashlib.sha1(f.read()).digest()
+    try:
+        index = PolygonIndex.load(path)
+        if index.source == source:
+            return index
+    except (IOError, OSError, ValueError, EOFError, struct.error):
+        pass
+    polygon = Polygon()
+    polygon.load_from_file(vertices_file)
+    index = PolygonIndex.from_polygon(polygon, source)
+    try:
+        index.save(path)
+    except (IOError, OSError):
+        logger.warning("Couldn't cache polygon index in %s", path)
+    return index
+
+
+_swiss_contour_index = None
+
+
+def swiss_contour_index():
+    """ Index of the contour of Switzerland, loaded once per process from
+    CACHE_DIR (set MOFA_PLACES_CACHE_DIR to change it)
+    """
+    global _swiss_contour_index
+    if _swiss_contour_index is None:
+        path = os.path.join(CACHE_DIR, 'contour_ch_wgs84.idx')
+        _swiss_contour_index = load_index(CONTOUR_CH, path)
+    return _swiss_contour_index
+
+
+def in_switzerland(longitude, latitude):
+    """ Whether a WGS84 coordinate is in Switzerland """
+    return swiss_contour_index().contains(longitude, latitude)
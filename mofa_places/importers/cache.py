@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+try:
+    replace = os.replace
+except AttributeError:
+    # python 2, rename replaces the destination on POSIX
+    replace = os.rename
+
+
+class CachedPage(object):
+
+    def __init__(self, content, etag=None, last_modified=None, fetched=None, fresh=True):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched = fetched
+        self.fresh = fresh
+
+    def validators(self):
+        """ Headers of a conditional request revalidating the page """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class PageCache(object):
+    """ Disk cache of fetched pages
+
+    Pages are stored compressed in files sharded in subdirectories by the
+    hash of their key. A page is stale once older than ttl seconds (never
+    if ttl is None) and can be revalidated with its ETag/Last-Modified.
+    When max_size (bytes) is set, the least recently stored pages are
+    evicted to keep the cache under that size. Files are written to a
+    temporary file and renamed, so readers never see partial pages.
+    """
+
+    SUFFIX = '.page'
+
+    def __init__(self, directory, ttl=None, max_size=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.size = None
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:4], digest + self.SUFFIX)
+
+    def get(self, key):
+        """ Get the page stored for key, None if there isn't any """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline().decode('utf-8'))
+                content = zlib.decompress(f.read())
+            fetched = os.path.getmtime(path)
+        except (IOError, OSError):
+            return None
+        except (ValueError, zlib.error):
+            logger.warning("Corrupted cache entry %s", path)
+            return None
+        fresh = self.ttl is None or time.time() - fetched < self.ttl
+        return CachedPage(content, header.get('etag'), header.get('last_modified'),
+                          fetched, fresh)
+
+    def set(self, key, content, etag=None, last_modified=None):
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another thread
+                if not os.path.isdir(directory):
+                    raise
+        header = json.dumps({'etag': etag, 'last_modified': last_modified})
+        data = header.encode('utf-8') + b'\n' + zlib.compress(content)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            replace(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+        if self.max_size is not None:
+            with self.lock:
+                if self.size is None:
+                    self.size = sum(size for _, _, size in self.entries())
+                else:
+                    self.size += len(data) - previous
+                if self.size > self.max_size:
+                    self.evict()
+
+    def touch(self, key):
+        """ Mark the page stored for key as fetched now (revalidated) """
+        try:
+            os.utime(self.path(key), None)
+        except OSError:
+            pass
+
+    def entries(self):
+        """ Iterate over (path, mtime, size) of the stored pages """
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(self.SUFFIX):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_mtime, stat.st_size
+
+    def evict(self):
+        """ Remove the oldest pages until the cache is under 90% of max_size """
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        size = sum(entry[2] for entry in entries)
+        target = self.max_size * 0.9
+        removed = 0
+        for path, _, entry_size in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+            removed += 1
+        self.size = size
+        logger.info("%d pages evicted from %s", removed, self.directory)
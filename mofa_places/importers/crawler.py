@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests import RequestException
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket(object):
+    """ Rate limiter allowing rate requests per second on average
+
+    Up to capacity requests can be made in a burst.
+    """
+
+    def __init__(self, rate, capacity=1, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.last = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until a token is available and take it """
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class Crawler(object):
+    """ Fetch pages from a pool of threads
+
+    All requests share one session (and its connection pool), go through
+    a token bucket limiting the number of requests per second and are
+    retried with an exponential backoff on connection errors and 429/5xx
+    responses.
+    """
+
+    def __init__(self, concurrency=4, rate=10, retries=3, backoff=0.5, timeout=30):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, capacity=concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pool = ThreadPool(concurrency)
+
+    def get(self, url, **kwargs):
+        """ GET url, raise a RequestException once all attempts failed """
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                response = self.session.get(url, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response
+                error = "status %d" % response.status_code
+                if attempt >= self.retries:
+                    response.raise_for_status()
+            except RequestException as e:
+                if attempt >= self.retries or getattr(e, 'response', None) is not None:
+                    raise
+                error = e
+            delay = self.backoff * 2 ** attempt
+            logger.info("Fetching %s failed (%s), retrying in %.1fs", url, error, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def map(self, func, items):
+        """ Apply func to all items concurrently
+
+        :return: list of (item, result) tuples in the order of items, result
+                 is None when func raised an exception (which is logged)
+        """
+        def call(item):
+            try:
+                return item, func(item)
+            except Exception:
+                logger.exception("Crawling %s failed", item)
+                return item, None
+        return self.pool.map(call, items)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.session.close()
@@ -0,0 +1,340 @@
+import json
+import logging
+import re
+import threading
+import time
+
+import requests
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+logger = logging.getLogger(__name__)
+
+
+def chunked(iterable, size):
+    """ Group items of an iterable in lists of at most size items """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class CommitAtEnd(object):
+    """ Commit once, after all documents have been sent """
+
+    params = None
+
+    def indexed(self, indexer, count):
+        pass
+
+    def close(self, indexer):
+        indexer.commit()
+
+
+class CommitWithin(CommitAtEnd):
+    """ Let the search server commit (soft commit) within the given delay
+
+    Documents are sent with the commitWithin parameter, a hard commit is
+    still issued at the end unless commit_on_close is False.
+    """
+
+    def __init__(self, milliseconds=10000, commit_on_close=True):
+        self.params = {'commitWithin': milliseconds}
+        self.commit_on_close = commit_on_close
+
+    def close(self, indexer):
+        if self.commit_on_close:
+            indexer.commit()
+
+
+class CommitEvery(CommitAtEnd):
+    """ Commit each time at least the given number of documents has been sent """
+
+    def __init__(self, documents=400):
+        self.documents = documents
+        self.pending = 0
+
+    def indexed(self, indexer, count):
+        self.pending += count
+        if self.pending >= self.documents:
+            indexer.commit()
+            self.pending = 0
+
+    def close(self, indexer):
+        if self.pending:
+            indexer.commit()
+            self.pending = 0
+
+
+COMMIT_POLICIES = {
+    'end': CommitAtEnd,
+    'within': CommitWithin,
+    'every': CommitEvery,
+}
+
+
+def commit_policy(name, *args):
+    """ Get a commit policy by name ('end', 'within' or 'every') """
+    try:
+        return COMMIT_POLICIES[name](*args)
+    except KeyError:
+        raise ValueError("Unknown commit policy %r" % name)
+
+
+class FixedBatchSize(object):
+
+    def __init__(self, size):
+        self.size = size
+
+    def update(self, count, elapsed):
+        pass
+
+
+class AdaptiveBatchSize(object):
+    """ Batch size following the measured latency of index calls
+
+    The size is scaled by the ratio between the target and the measured
+    latency of the last call (at most halved or doubled each time) and
+    kept between minimum and maximum.
+    """
+
+    def __init__(self, size=400, minimum=50, maximum=5000, target=1.0):
+        self.size = size
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target
+
+    def update(self, count, elapsed):
+        if count < self.size:
+            # partial (last) batch, not representative
+            return
+        ratio = self.target / max(elapsed, 0.001)
+        ratio = min(max(ratio, 0.5), 2.0)
+        self.size = int(min(max(self.size * ratio, self.minimum), self.maximum))
+
+
+class BatchIndexer(object):
+    """ Sink sending documents to an indexer in batches
+
+    Documents are buffered until a batch is complete, so the memory held by
+    the sink is bounded by the batch size. batch_size is either a number of
+    documents or an object with a size attribute and an update(count,
+    elapsed) method (see AdaptiveBatchSize); commit_policy decides when
+    documents are committed (CommitAtEnd by default).
+    """
+
+    def __init__(self, indexer, batch_size=400, commit_policy=None):
+        self.indexer = indexer
+        if isinstance(batch_size, int):
+            batch_size = FixedBatchSize(batch_size)
+        self.batch_size = batch_size
+        self.commit_policy = commit_policy or CommitAtEnd()
+        self.docs = []
+        self.indexed = 0
+        self.failed = 0
+
+    def add(self, doc):
+        self.docs.append(doc)
+        if len(self.docs) >= self.batch_size.size:
+            self.flush()
+
+    def consume(self, docs):
+        for doc in docs:
+            self.add(doc)
+        self.close()
+
+    def flush(self):
+        if self.docs:
+            count = len(self.docs)
+            start = time.time()
+            self.index(self.docs)
+            self.batch_size.update(count, time.time() - start)
+            self.commit_policy.indexed(self.indexer, count)
+            self.indexed += count
+            self.docs = []
+
+    def index(self, docs):
+        params = self.commit_policy.params
+        if params:
+            self.indexer.index(docs, params=params)
+        else:
+            self.indexer.index(docs)
+
+    def close(self):
+        self.flush()
+        if self.indexed:
+            self.commit_policy.close(self.indexer)
+        logger.info("%d documents indexed", self.indexed)
+
+
+class ThreadedBatchIndexer(BatchIndexer):
+    """ Sink sending batches to the indexer from a pool of worker threads
+
+    Batches wait in a queue of at most queue_size batches: documents keep
+    being produced while previous batches are in flight, and the producer
+    blocks when the workers can't keep up. A batch failing to be indexed
+    is logged and counted in failed (number of documents lost).
+    """
+
+    def __init__(self, indexer, batch_size=400, commit_policy=None, workers=2, queue_size=None):
+        # workers don't share the context of the caller, resolve proxies
+        # (e.g. moxie's searcher) to the underlying object
+        get_current_object = getattr(indexer, '_get_current_object', None)
+        if get_current_object:
+            indexer = get_current_object()
+        super(ThreadedBatchIndexer, self).__init__(indexer, batch_size, commit_policy)
+        self.lock = threading.Lock()
+        self.queue = Queue(queue_size or workers * 2)
+        self.workers = [threading.Thread(target=self.work) for _ in range(workers)]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+    def flush(self):
+        if self.docs:
+            self.queue.put(self.docs)
+            self.docs = []
+
+    def work(self):
+        while True:
+            docs = self.queue.get()
+            if docs is None:
+                break
+            count = len(docs)
+            try:
+                start = time.time()
+                self.index(docs)
+                elapsed = time.time() - start
+                with self.lock:
+                    self.batch_size.update(count, elapsed)
+                    self.commit_policy.indexed(self.indexer, count)
+                    self.indexed += count
+            except Exception:
+                logger.exception("Batch of %d documents not indexed", count)
+                with self.lock:
+                    self.failed += count
+
+    def consume(self, docs):
+        try:
+            for doc in docs:
+                self.add(doc)
+        except BaseException:
+            # don't leave the workers waiting for batches, nothing is committed
+            self.stop()
+            raise
+        self.close()
+
+    def stop(self):
+        """ Wait for the batches in the queue to be sent and stop the workers """
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def close(self):
+        self.flush()
+        self.stop()
+        if self.indexed:
+            self.commit_policy.close(self.indexer)
+        logger.info("%d documents indexed, %d failed", self.indexed, self.failed)
+
+
+class StreamingIndexer(object):
+    """ Sink streaming all documents to a Solr update handler in one request
+
+    Documents are serialized one at a time into a JSON array sent with a
+    chunked request while the generator produces them, the payload is never
+    held in memory (only the ids of the documents sent, to report errors).
+    Errors are kept in errors as (offset, id, message) tuples, offset
+    being the position of the document in the stream (None when Solr
+    rejected the request without naming a document).
+
+    :param update_url: URL of the update handler (e.g. .../staging/update)
+    :param params: parameters of the request (e.g. {'commitWithin': 10000})
+    :param commit: commit when all documents have been sent
+    :param chunk_size: bytes buffered before a chunk is sent
+    """
+
+    DOC_ERROR = re.compile(r'\[doc=([^\]]+)\]')
+
+    def __init__(self, update_url, params=None, commit=True, chunk_size=64 * 1024,
+                 session=None, timeout=None):
+        self.update_url = update_url
+        self.params = dict(params or {})
+        if commit:
+            self.params['commit'] = 'true'
+        self.params['wt'] = 'json'
+        self.chunk_size = chunk_size
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.offsets = {}
+        self.sent = 0
+        self.indexed = 0
+        self.failed = 0
+        self.errors = []
+
+    def consume(self, docs):
+        try:
+            response = self.session.post(self.update_url, data=self.serialize(docs),
+                                         params=self.params, timeout=self.timeout,
+                                         headers={'Content-type': 'application/json'})
+        except requests.RequestException as e:
+            self.errors.append((None, None, str(e)))
+            self.failed += self.sent
+        else:
+            self.parse_response(response)
+        for offset, ident, message in self.errors:
+            logger.warning("Document %s (offset %s) not indexed: %s", ident, offset, message)
+        logger.info("%d documents indexed, %d failed", self.indexed, self.failed)
+
+    def serialize(self, docs):
+        """ Generate the chunks of the body of the request """
+        buf = [b'[']
+        size = 1
+        for offset, doc in enumerate(docs):
+            try:
+                data = json.dumps(doc).encode('utf-8')
+            except (TypeError, ValueError) as e:
+                self.errors.append((offset, doc.get('id'), "Not serializable: %s" % e))
+                self.failed += 1
+                continue
+            if self.sent:
+                buf.append(b',')
+            buf.append(data)
+            size += len(data) + 1
+            self.offsets[doc.get('id')] = offset
+            self.sent += 1
+            if size >= self.chunk_size:
+                yield b''.join(buf)
+                buf = []
+                size = 0
+        buf.append(b']')
+        yield b''.join(buf)
+
+    def parse_response(self, response):
+        try:
+            content = response.json()
+        except ValueError:
+            content = {}
+        if not response.ok:
+            # Solr stops at the first error, nothing is committed
+            message = content.get('error', {}).get('msg') or response.reason
+            match = self.DOC_ERROR.search(message or '')
+            ident = match.group(1) if match else None
+            self.errors.append((self.offsets.get(ident), ident, message))
+            self.failed += self.sent
+            return
+        # documents rejected by a TolerantUpdateProcessor, the others are indexed
+        rejected = content.get('responseHeader', {}).get('errors', [])
+        for error in rejected:
+            ident = error.get('id')
+            self.errors.append((self.offsets.get(ident), ident, error.get('message')))
+        self.failed += len(rejected)
+        self.indexed = self.sent - len(rejected)
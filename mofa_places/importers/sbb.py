@@ -1,10 +1,14 @@
+import hashlib
+import json
 import logging
-import sqlite3
 
 from xml.sax import ContentHandler, make_parser
 from collections import defaultdict
 
 from moxie.places.importers.helpers import prepare_document
+from mofa_places.importers.store import connect_readonly
+from mofa_places.importers.indexing import (BatchIndexer, ThreadedBatchIndexer, StreamingIndexer,
+                                            chunked)
 
 logger = logging.getLogger(__name__)
 
@@ -19,39 +23,148 @@ def dict_factory(cursor, row):
     return d
 
 
+def read_stations(conn, arraysize=500):
+    """ Iterate over the rows of the station table
+
+    Rows are fetched from the cursor arraysize at a time instead of
+    loading the whole table in memory.
+    """
+    cursor = conn.cursor()
+    cursor.arraysize = arraysize
+    cursor.execute("SELECT * FROM station")
+    while True:
+        rows = cursor.fetchmany()
+        if not rows:
+            break
+        for row in rows:
+            yield row
+
+
+def document_hash(data):
+    """ Short hash of the content of a document """
+    content = json.dumps(data, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(content).hexdigest()[:16]
+
+
+class SearchResults(object):
+    """ Part of a batched search response matching a single document """
+
+    def __init__(self, results):
+        self.results = results
+
+
 class SbbStationImporter(object):
-    def __init__(self, indexer, precedence, sbb_db, areas, identifier_key='identifiers'):
+    def __init__(self, indexer, precedence, sbb_db, areas, identifier_key='identifiers',
+                 lookup_batch_size=100, batch_size=400, commit_policy=None,
+                 checkpoint=None, workers=0, bulk_url=None, search_rows=10):
         self.indexer = indexer
         self.precedence = precedence
         self.sbb_db = sbb_db
         self.areas = areas
         self.identifier_key = identifier_key
+        # number of stations whose identifiers are resolved by one search
+        self.lookup_batch_size = lookup_batch_size
+        # number of results returned by a search (rows of the backend),
+        # chunks whose search may have been truncated are split
+        self.search_rows = search_rows
+        self.batch_size = batch_size
+        self.commit_policy = commit_policy
+        # content hashes of the stations from the previous import (incremental
+        # import), only stations added or changed since then are indexed
+        self.checkpoint = checkpoint
+        self.hashes = {}
+        self.removed = []
+        # number of threads sending batches to the indexer, 0 to index
+        # from the importing thread
+        self.workers = workers
+        # update handler documents are streamed to in a single request
+        # (bulk mode), instead of being sent in batches through the indexer
+        self.bulk_url = bulk_url
+        self.failed = 0
 
     def run(self):
-        conn = sqlite3.connect(self.sbb_db)
+        conn = connect_readonly(self.sbb_db)
         conn.row_factory = dict_factory
-        db = conn.cursor()
-        if self.indexer:
-            docs = []
-            sql = "SELECT * FROM station"
-            for i, row in enumerate(db.execute(sql).fetchall()):
-                data = {}
-                data['id'] = "stoparea:%s" % str(row['id'])
-                data[self.identifier_key] = [str(row['id']), 'sbb:%s' % row['id']]
-                data['location'] = "%s,%s" % (row['x'], row['y'])
-                data['name'] = row['name']
-                data['name_sort'] = row['name']
-                data['type'] = "/transport/rail-station"
-                data['tags'] = []
-                search_results = self.indexer.search_for_ids(
-                    self.identifier_key, data[self.identifier_key])
-                docs.append(prepare_document(data, search_results, self.precedence))
-                if not (i + 1) % 400:
-                    self.indexer.index(docs)
-                    self.indexer.commit()
-                    docs = []
-            self.indexer.index(docs)
-            self.indexer.commit()
+        try:
+            if self.indexer:
+                if self.bulk_url:
+                    sink = StreamingIndexer(self.bulk_url, getattr(self.commit_policy, 'params', None))
+                elif self.workers:
+                    sink = ThreadedBatchIndexer(self.indexer, self.batch_size,
+                                                self.commit_policy, self.workers)
+                else:
+                    sink = BatchIndexer(self.indexer, self.batch_size, self.commit_policy)
+                sink.consume(self.documents(read_stations(conn)))
+                self.failed = sink.failed
+        finally:
+            conn.close()
+
+        if self.checkpoint is not None:
+            self.removed = [ident for ident in self.checkpoint
+                            if ident not in self.hashes]
+
+    def documents(self, rows):
+        """ Generate documents ready to be indexed from station rows
+
+        Content hashes of all stations are recorded in self.hashes, stations
+        unchanged since the checkpoint are skipped.
+        """
+        for chunk in chunked(self.changed(rows), self.lookup_batch_size):
+            for data, search_results in self.search_for_ids(chunk):
+                yield prepare_document(data, search_results, self.precedence)
+
+    def changed(self, rows):
+        for row in rows:
+            data = self.build_document(row)
+            ident = str(row['id'])
+            self.hashes[ident] = document_hash(data)
+            if self.checkpoint is None or self.checkpoint.get(ident) != self.hashes[ident]:
+                yield data
+
+    def build_document(self, row):
+        data = {}
+        data['id'] = "stoparea:%s" % str(row['id'])
+        data[self.identifier_key] = [str(row['id']), 'sbb:%s' % row['id']]
+        data['location'] = "%s,%s" % (row['x'], row['y'])
+        data['name'] = row['name']
+        data['name_sort'] = row['name']
+        data['type'] = "/transport/rail-station"
+        data['tags'] = []
+        return data
+
+    def search_for_ids(self, docs):
+        """ Resolve the identifiers of all docs with a single search, split
+        in smaller searches when it returned search_rows results (some
+        results may be missing)
+
+        :param docs: list of documents
+        :return: list of (document, SearchResults) tuples, each SearchResults
+                 holding the results sharing an identifier with the document
+        """
+        identifiers = []
+        for data in docs:
+            identifiers.extend(data[self.identifier_key])
+        if not identifiers:
+            return []
+        response = self.indexer.search_for_ids(self.identifier_key, identifiers)
+        if len(docs) > 1 and len(response.results) >= self.search_rows:
+            # results may be missing, resolve each half separately
+            middle = len(docs) // 2
+            return self.search_for_ids(docs[:middle]) + self.search_for_ids(docs[middle:])
+
+        by_identifier = defaultdict(list)
+        for i, result in enumerate(response.results):
+            for ident in result.get(self.identifier_key, []):
+                by_identifier[ident].append(i)
+
+        resolved = []
+        for data in docs:
+            matches = set()
+            for ident in data[self.identifier_key]:
+                matches.update(by_identifier.get(ident, []))
+            results = [response.results[i] for i in sorted(matches)]
+            resolved.append((data, SearchResults(results)))
+        return resolved
 
 
 
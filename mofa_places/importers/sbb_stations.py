@@ -1,219 +1,213 @@
 #! -*_ coding: utf-8 -*-
 from __future__ import print_function
 
-import cgi
-import csv
-import hashlib
 import os.path
-import re
-import requests
-import sqlite3
-import time
 import datetime
-from lxml import etree
+from collections import deque
 
+from mofa_places.geofence import swiss_contour
+from mofa_places.importers.cache import CachedPage, PageCache
+from mofa_places.importers.crawler import Crawler
+from mofa_places.importers.stationboard import StationExtractor, find_ambiguous, parse_stations
+from mofa_places.importers.store import StationStore
 
-BOUNDS = '5.85,45.75,10.7,47.8'
+# Polygon and dict_factory used to be defined in this module, still
+# importable from here for compatibility
+from mofa_places.geofence import Polygon
+from mofa_places.importers.store import dict_factory
 
-def dict_factory(cursor, row):
-    """ Return sqlite data as dict """
-    d = {}
-    for idx,col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
 
+BOUNDS = '5.85,45.75,10.7,47.8'
+STATIONBOARD_URL = "http://fahrplan.sbb.ch/bin/stboard.exe/dn"
 
 def now():
     return datetime.datetime.now().isoformat()
 
-class Polygon(object):
-
-    def __init__(self):
-        self.vertices = []
-
-    def load_from_file(self, f):
-        with open(f, 'rb') as csvfile:
-            locreader = csv.reader(csvfile)
-            self.vertices.extend([{'x': row[0], 'y': row[1]} for row in locreader])
-
-    def contains_point(self, point):
-        px = point['x']
-        py = point['y']
-
-        inPolygon = False
-        j = len(self.vertices) - 1
-        for i, v in enumerate(self.vertices):
-            v1x = v['x']
-            v1y = v['y']
-            v2x = self.vertices[j]['x']
-            v2y = self.vertices[j]['y']
-
-            if (((v1y > py) != (v2y > py)) and (px < (v2x - v1x) * (py - v1y) / (v2y - v1y) + v1x)):
-                inPolygon = not inPolygon
-
-            j = i
-
-        return inPolygon
 
 class Stations(object):
     """ Crawl SBB page to fetch stations and put it in a sqlite DB """
 
-    def __init__(self):
+    def __init__(self, db='example.db', url=STATIONBOARD_URL, cache_dir=None,
+                 concurrency=4, rate=10, cache_ttl=7 * 24 * 3600, cache_max_size=None,
+                 processes=0):
         self.basedir = os.getcwd()
-        self.conn = sqlite3.connect('example.db')
-        self.conn.row_factory = dict_factory
+        self.url = url
+        self.cache_dir = cache_dir or os.path.join(self.basedir, "tmp", "cache", "station")
+        # pages older than cache_ttl seconds are revalidated
+        self.cache = PageCache(self.cache_dir, ttl=cache_ttl, max_size=cache_max_size)
+        # number of processes parsing pages, 0 to parse in this process.
+        # They are forked before the threads of the crawler are started, a
+        # fork copies the locks held by other threads (e.g. logging's).
+        self.extractor = StationExtractor(processes)
+        self.crawler = Crawler(concurrency=concurrency, rate=rate)
+        self.store = StationStore(db)
+        self.conn = self.store.conn
         self.db = self.conn.cursor()
-        default_station = {'id': '8503000',
+        default_station = {'id': 8503000,
                            'name': u'Zürich HB',
                            'x': 8.540192,
                            'y': 47.378177,
                            'modified': now()}
-        self.db.execute("""CREATE TABLE station (
-                id INTEGER PRIMARY KEY,
-                name VARCHAR(255),
-                x REAL,
-                y REAL,
-                type VARCHAR(25),
-                modified TEXT
+        # state of the crawl, to resume an interrupted crawl
+        self.db.execute("""CREATE TABLE IF NOT EXISTS crawl_frontier (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id INTEGER UNIQUE
+        )""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS crawl_visited (
+                id INTEGER PRIMARY KEY
         )""")
 
-        self.insertStation(default_station)
-        self.conn.commit()
+        if not self.db.execute("SELECT id FROM station LIMIT 1").fetchall():
+            self.insertStation(default_station)
+        self.store.commit()
 
     def extractIDs(self, rows):
         return [row['id'] for row in rows]
 
     def fetch(self):
-        sql = "SELECT * FROM station"
-        checkedIDs = []
-
-        stopSearching = False
-        while not stopSearching:
-            stopSearching = True
-
-            rows = self.db.execute(sql).fetchall()
-            dbIDs = self.extractIDs(rows)
-
-            print('\nSTART ITERATION: %s records in DB / %s visited' % (len(rows), len(checkedIDs)))
-
-            for station in rows:
-                sbbID = station['id']
-                if sbbID in checkedIDs:
-                    continue
-
-                # p "Searching around " + station['name'] + "(" + sbbID + ")"
-                newStations = self.findStationsNear(sbbID)
+        """ Breadth-first crawl from the stations in the DB
+
+        Each station is expanded once. The frontier and the visited
+        stations are stored with the stations after each batch, so an
+        interrupted crawl resumes where it stopped. A station whose page
+        couldn't be fetched stays in the stored frontier and is retried
+        on the next crawl.
+        """
+        known = set(self.extractIDs(self.db.execute("SELECT id FROM station")))
+        visited = set(self.extractIDs(self.db.execute("SELECT id FROM crawl_visited")))
+        frontier = deque(self.extractIDs(
+            self.db.execute("SELECT id FROM crawl_frontier ORDER BY seq")))
+        if not frontier and not visited:
+            # new crawl
+            frontier.extend(sorted(known))
+            self.db.executemany("INSERT INTO crawl_frontier (id) VALUES (?)",
+                                [(ident,) for ident in frontier])
+            self.conn.commit()
+
+        print('\nSTART CRAWL: %s records in DB / %s visited / %s to visit' % (len(known), len(visited), len(frontier)))
+
+        batch_size = self.crawler.concurrency * 4
+        while frontier:
+            batch = [frontier.popleft() for _ in range(min(batch_size, len(frontier)))]
+            # pages are fetched concurrently then parsed (in the pool of
+            # the extractor), results are handled in order
+            pages = [(sbbID, content) for sbbID, content
+                     in self.crawler.map(self.fetchPage, batch) if content is not None]
+            for (sbbID, content), stations in zip(pages, self.extractor.extract(pages)):
+                newStations = self.stationsFromPage(sbbID, content, stations)
                 for station in newStations:
-                    if station['id'] in dbIDs:
+                    if station['id'] in known:
                         continue
                     print(".",end="")
                     self.insertStation(station)
-                self.conn.commit()
+                    known.add(station['id'])
+                    frontier.append(station['id'])
+                    self.db.execute("INSERT INTO crawl_frontier (id) VALUES (?)", [station['id']])
 
-                checkedIDs.append(sbbID)
-
-                newIDs = self.extractIDs(newStations)
-                if len(set(newIDs).difference(dbIDs)) > 0:
-                    # New stations found, mark another iteration
-                    stopSearching = False
-
-                dbIDs += newIDs
+                visited.add(sbbID)
+                self.db.execute("INSERT OR IGNORE INTO crawl_visited (id) VALUES (?)", [sbbID])
+                self.db.execute("DELETE FROM crawl_frontier WHERE id = ?", [sbbID])
+            self.store.commit()
 
     def insertStation(self, station):
-        sql = "INSERT INTO station (id, name, x, y) VALUES (?, ?, ?, ?)"
-        self.db.execute(sql, [station['id'], station['name'], station['x'], station['y']])
+        self.store.add(station)
 
     def findStationsNear(self, input_, ignoreAmbigous=True):
+        return self.stationsFromPage(input_, self.fetchPage(input_, ignoreAmbigous))
+
+    def fetchPage(self, input_, ignoreAmbigous=True):
+        """ Get the "stations near" page of input_ from the cache or SBB """
         input_ = str(input_)
-        if re.search(r'^[0-9]+?$', input_) is None:
-            sha1 = hashlib.sha1()
-            sha1.update(input_)
-            cacheFile = sha1.hexdigest() + '.html'
-        else:
-            cacheFile = input_ + '.html'
-
-        # TODO: stationCacheFolder - global scope ?
-        # XXX generate directories 
-        stationCacheFolder = os.path.join(self.basedir, "tmp", "cache", "station")
-        stationCacheFile = os.path.join(stationCacheFolder, cacheFile)
-
-        def fetchSBBStation(input_, cacheFile, ignoreAmbigous):
-            sbbURL = "http://fahrplan.sbb.ch/bin/stboard.exe/dn?distance=50&input=" + cgi.escape(input_) + "&near=Anzeigen"
-            #print("Fetching ", sbbURL)
-            r = requests.get(sbbURL)
-            sbbHTML = (r.text)
-            time.sleep(0.1)
-
-            if not ignoreAmbigous:
-                isAmbigous = re.search(r'<option value=".+?#([0-9]+?)">', sbbHTML)
-                if isAmbigous is not None:
-                    ignoreAmbigous = True
-                    fetchSBBStation(isAmbigous[1], cacheFile, params)
-            with open(cacheFile, 'w') as f:
-                  f.write(sbbHTML)
-
-        if not os.path.exists(stationCacheFile):
-          fetchSBBStation(input_, stationCacheFile, ignoreAmbigous)
-
-        scf = open(stationCacheFile)
-        parser = etree.HTMLParser()
-        doc = etree.parse(scf, parser)
 
+        def fetchSBBStation(input_, ignoreAmbigous, headers):
+            r = self.crawler.get(self.url, params={'distance': 50,
+                                                   'input': input_,
+                                                   'near': 'Anzeigen'},
+                                 headers=headers)
+
+            if not ignoreAmbigous and r.status_code != 304:
+                ambiguousID = find_ambiguous(r.content)
+                if ambiguousID is not None:
+                    return fetchSBBStation(ambiguousID, True, {})
+            return r
+
+        page = self.cache.get(input_)
+        if page is None or not page.fresh:
+            r = fetchSBBStation(input_, ignoreAmbigous, page.validators() if page else {})
+            if r.status_code == 304:
+                self.cache.touch(input_)
+            else:
+                page = CachedPage(r.content)
+                self.cache.set(input_, r.content, r.headers.get('ETag'),
+                               r.headers.get('Last-Modified'))
+        return page.content
+
+    def stationsFromPage(self, input_, content, stations=None):
+        """ Stations listed on the page of input_
+
+        :param stations: stations already extracted from the page
+        """
+        if stations is None:
+            stations = parse_stations(content, input_)
         newStations = []
-        for tr in doc.xpath('.//tr[@class="zebra-row-0" or @class="zebra-row-1"]'):
-            href = tr.find('td[1]/a').attrib['href']
-            coordinates = re.search("MapLocation\.X=([0-9]+?)&MapLocation\.Y=([0-9]+?)&", href).groups()
-            longitude = int(coordinates[0]) * 0.000001
-            latitude = int(coordinates[1]) * 0.000001
-
-            if self.pointIsOutside(longitude, latitude):
-                continue
-
-            try:
-                idmatch  = re.search("input=([0-9]+?)&", tr.xpath('td[2]/a')[0].attrib['href'])
-            except IndexError:
-                print("Error @ %s" % (input_))
+        for station in stations:
+            if self.pointIsOutside(station['x'], station['y']):
                 continue
-            if idmatch is None:
-                print("Error @ %s" % (input_))
-                continue
-
-            sbbID = idmatch.group(1)
-            newStations.append({
-                'id':  int(sbbID),
-                'name': tr.xpath('td[2]/a')[0].text.strip(),
-                'x': longitude,
-                'y': latitude,
-                'modified': now()})
-
+            station['modified'] = now()
+            newStations.append(station)
         return newStations
 
     def pointIsOutside(self, longitude, latitude):
-        cornerSW_X, cornerSW_Y, cornerNE_X, cornerNE_Y = BOUNDS.split(',')
+        cornerSW_X, cornerSW_Y, cornerNE_X, cornerNE_Y = [float(c) for c in BOUNDS.split(',')]
 
+        # never true: stations outside of the bounds are crawled like the
+        # others and removed by clean_geo
         return (longitude < cornerSW_X) and (latitude > cornerNE_Y) and (longitude > cornerNE_X) and (latitude < cornerSW_Y)
 
     def clean_geo(self):
+        """ Remove the stations outside of Switzerland """
         sql = "SELECT id, x, y FROM station"
-        rows = self.db.execute(sql)
+        rows = self.db.execute(sql).fetchall()
 
-        contourCSV = os.path.join(os.path.dirname(__file__), "resources", "contour_ch_wgs84.txt")
-        chPolygon = Polygon()
-        chPolygon.load_from_file(contourCSV)
+        chPolygon = swiss_contour()
+        inside = chPolygon.contains_points([r['x'] for r in rows], [r['y'] for r in rows])
 
-        for r in rows:
-            if not chPolygon.contains_point({'x': r['x'], 'y': r['y']}):
-                sql = "DELETE FROM station WHERE id = " + str(r['id'])
-                self.db.execute(sql)
-        self.conn.commit()
+        outside = [r['id'] for r, isInside in zip(rows, inside) if not isInside]
+        self.store.delete(outside)
+        self.store.commit()
+        return len(outside)
 
 
 def main():
-    # XXX if it is there 
-    os.remove('example.db')
-    s = Stations()
+    import argparse
+    parser = argparse.ArgumentParser(description="Crawl SBB stations")
+    parser.add_argument('--db', default='example.db',
+                        help="path of the station database")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="number of pages fetched at the same time")
+    parser.add_argument('--rate', type=float, default=10,
+                        help="maximum number of requests per second")
+    parser.add_argument('--resume', action='store_true',
+                        help="resume an interrupted crawl instead of starting again")
+    parser.add_argument('--cache-ttl', type=int, default=7 * 24 * 3600,
+                        help="age in seconds after which cached pages are revalidated")
+    parser.add_argument('--cache-max-size', type=int, default=None,
+                        help="maximum size of the page cache in bytes")
+    parser.add_argument('--processes', type=int, default=0,
+                        help="number of processes parsing pages")
+    args = parser.parse_args()
+    if not args.resume:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    s = Stations(db=args.db, concurrency=args.concurrency, rate=args.rate,
+                 cache_ttl=args.cache_ttl, cache_max_size=args.cache_max_size,
+                 processes=args.processes)
     s.fetch()
     s.clean_geo()
+    s.crawler.close()
+    s.extractor.close()
+    s.store.close()
 
 
 if __name__ == '__main__':
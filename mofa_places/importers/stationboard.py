@@ -0,0 +1,138 @@
+import logging
+import re
+import threading
+from multiprocessing import Pool
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+ROW_CLASSES = ('zebra-row-0', 'zebra-row-1')
+ROWS = etree.XPath('.//tr[@class="zebra-row-0" or @class="zebra-row-1"]')
+MAP_LINK = etree.XPath('string(td[1]/a/@href)')
+STATION_LINK = etree.XPath('td[2]/a')
+COORDINATES = re.compile(r'MapLocation\.X=([0-9]+?)&MapLocation\.Y=([0-9]+?)&')
+STATION_ID = re.compile(r'input=([0-9]+?)&')
+AMBIGUOUS = re.compile(br'<option value=".+?#([0-9]+?)">')
+
+_local = threading.local()
+
+
+def get_parser():
+    """ HTML parser reused by the calls made from the same thread """
+    parser = getattr(_local, 'parser', None)
+    if parser is None:
+        parser = _local.parser = etree.HTMLParser()
+    return parser
+
+
+def find_ambiguous(content):
+    """ Return the station ID of the first choice offered by a page
+    asking to choose between several stations, None otherwise
+    """
+    match = AMBIGUOUS.search(content)
+    if match is not None:
+        return match.group(1).decode('ascii')
+    return None
+
+
+def parse_row(tr, source=None):
+    """ Extract the station of a row of the table of stations
+
+    :return: dict with id, name, x (longitude) and y (latitude), None if
+             the row isn't valid
+    """
+    coordinates = COORDINATES.search(MAP_LINK(tr))
+    links = STATION_LINK(tr)
+    if coordinates is None or not links:
+        logger.warning("Error @ %s", source)
+        return None
+    link = links[0]
+    idmatch = STATION_ID.search(link.get('href', ''))
+    if idmatch is None:
+        logger.warning("Error @ %s", source)
+        return None
+    return {'id': int(idmatch.group(1)),
+            'name': (link.text or '').strip(),
+            'x': int(coordinates.group(1)) * 0.000001,
+            'y': int(coordinates.group(2)) * 0.000001}
+
+
+def parse_stations(content, source=None):
+    """ Extract the stations of a page
+
+    :param content: HTML of the page (bytes)
+    :param source: description of the page used in error messages
+    :return: list of dicts with id, name, x (longitude) and y (latitude)
+    """
+    if not content:
+        return []
+    root = etree.fromstring(content, get_parser())
+    if root is None:
+        return []
+    stations = []
+    for tr in ROWS(root):
+        station = parse_row(tr, source)
+        if station is not None:
+            stations.append(station)
+    return stations
+
+
+def iter_stations(chunks, source=None):
+    """ Extract the stations of a page while it is received
+
+    Rows are parsed as soon as they are complete, then removed from the
+    tree with the rows before them: the memory used doesn't grow with the
+    size of the page.
+
+    :param chunks: iterable of parts of the HTML of the page (bytes)
+    :return: iterator of dicts with id, name, x (longitude) and y (latitude)
+    """
+    parser = etree.HTMLPullParser(events=('end',), tag='tr')
+    for chunk in chunks:
+        parser.feed(chunk)
+        for station in _read_rows(parser, source):
+            yield station
+    parser.close()
+    for station in _read_rows(parser, source):
+        yield station
+
+
+def _read_rows(parser, source):
+    for _, tr in parser.read_events():
+        station = None
+        if tr.get('class') in ROW_CLASSES:
+            station = parse_row(tr, source)
+        # rows of nested tables are freed with their outer row
+        if tr.getparent() is not None and not any(a.tag == 'tr' for a in tr.iterancestors()):
+            tr.clear()
+            while tr.getprevious() is not None:
+                del tr.getparent()[0]
+        if station is not None:
+            yield station
+
+
+def _parse_item(item):
+    source, content = item
+    return parse_stations(content, source)
+
+
+class StationExtractor(object):
+    """ Parse pages, in a pool of processes when processes isn't 0 """
+
+    def __init__(self, processes=0):
+        self.pool = Pool(processes) if processes else None
+
+    def extract(self, pages):
+        """ Parse (source, content) pairs
+
+        :return: list of lists of stations, in the order of pages
+        """
+        if self.pool is None:
+            return [_parse_item(page) for page in pages]
+        return self.pool.map(_parse_item, pages, chunksize=4)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
@@ -0,0 +1,170 @@
+#! -*_ coding: utf-8 -*-
+from __future__ import print_function
+
+import csv
+import datetime
+import io
+import logging
+import os
+import re
+import sys
+import tempfile
+import zipfile
+
+from mofa_places.geofence import swiss_contour
+from mofa_places.importers.cache import replace
+from mofa_places.importers.indexing import chunked
+from mofa_places.importers.store import StationStore
+
+logger = logging.getLogger(__name__)
+
+# columns of the id, name, longitude and latitude of a stop in each format
+GTFS_COLUMNS = ('stop_id', 'stop_name', 'stop_lon', 'stop_lat')
+SBB_COLUMNS = ('BPUIC', 'BEZEICHNUNG_OFFIZIELL', 'E_WGS84', 'N_WGS84')
+
+# numeric station ID in GTFS stop IDs (8503000, 8503000:0:3, Parent8503000)
+STOP_ID = re.compile(r'([0-9]+)')
+
+# python 2's csv module only reads bytes
+PY2 = sys.version_info[0] == 2
+
+
+def open_stops(path):
+    """ Open a stop list: a CSV file or a GTFS feed (zip)
+
+    Text is read on Python 3, UTF-8 bytes on Python 2.
+    """
+    if zipfile.is_zipfile(path):
+        f = zipfile.ZipFile(path).open('stops.txt')
+        if PY2:
+            return f
+        return io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+    if PY2:
+        return open(path, 'rb')
+    return io.open(path, encoding='utf-8-sig', newline='')
+
+
+def _csv_lines(f):
+    """ Lines of f for the csv module, UTF-8 bytes on Python 2 """
+    for line in f:
+        if PY2 and isinstance(line, unicode):
+            line = line.encode('utf-8')
+        yield line
+
+
+def _decode(row):
+    if PY2:
+        return [field.decode('utf-8') for field in row]
+    return row
+
+
+def read_stops(f):
+    """ Iterate over the stations of a GTFS stops.txt or SBB station CSV
+
+    Only stations are kept from GTFS files, not their platforms (stops
+    having a parent station) or entrances.
+
+    :return: iterator of dicts with id, name, x (longitude) and y (latitude)
+    """
+    lines = _csv_lines(f)
+    header = next(lines, '')
+    # byte order mark of files not opened as utf-8-sig
+    if header.startswith(b'\xef\xbb\xbf' if PY2 else u'\ufeff'):
+        header = header[3 if PY2 else 1:]
+    dialect = csv.Sniffer().sniff(header, delimiters=',;\t')
+    fields = _decode(next(csv.reader([header], dialect)))
+    if set(GTFS_COLUMNS) <= set(fields):
+        columns, gtfs = GTFS_COLUMNS, True
+    elif set(SBB_COLUMNS) <= set(fields):
+        columns, gtfs = SBB_COLUMNS, False
+    else:
+        raise ValueError("Unknown stop list format (columns %s)" % ', '.join(fields))
+    id_column, name_column, x_column, y_column = columns
+    for values in csv.reader(lines, dialect):
+        row = dict(zip(fields, _decode(values)))
+        if gtfs and (row.get('parent_station') or row.get('location_type') not in (None, '', '0', '1')):
+            continue
+        match = STOP_ID.search(row[id_column] or '')
+        try:
+            x = float(row[x_column])
+            y = float(row[y_column])
+        except (TypeError, ValueError):
+            match = None
+        if match is None:
+            logger.warning("Invalid stop %s", row[id_column])
+            continue
+        yield {'id': int(match.group(1)),
+               'name': row[name_column],
+               'x': x,
+               'y': y}
+
+
+class StopsImporter(object):
+    """ Store the stations of a stop list in a StationStore
+
+    Stations are classified by the polygon (the contour of Switzerland by
+    default) batch_size at a time, stations outside are skipped.
+    """
+
+    def __init__(self, store, polygon=None, batch_size=1000):
+        self.store = store
+        self.polygon = polygon or swiss_contour()
+        self.batch_size = batch_size
+        self.imported = 0
+        self.outside = 0
+
+    def run(self, f):
+        modified = datetime.datetime.now().isoformat()
+        for batch in chunked(read_stops(f), self.batch_size):
+            inside = self.polygon.contains_points([s['x'] for s in batch], [s['y'] for s in batch])
+            for station, is_inside in zip(batch, inside):
+                if is_inside:
+                    station['modified'] = modified
+                    self.store.add(station)
+                    self.imported += 1
+                else:
+                    self.outside += 1
+        self.store.commit()
+        logger.info("%d stations imported, %d outside of the polygon", self.imported, self.outside)
+
+
+def build_station_db(stops, db):
+    """ Build the station DB db from the stop list file stops
+
+    The DB is written next to db and replaces it once complete, readers
+    never see a partial DB.
+
+    :return: the StopsImporter
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(db)), suffix='.db')
+    os.close(fd)
+    try:
+        store = StationStore(tmp)
+        f = open_stops(stops)
+        try:
+            importer = StopsImporter(store)
+            importer.run(f)
+        finally:
+            f.close()
+            store.close()
+        replace(tmp, db)
+    except Exception:
+        os.remove(tmp)
+        raise
+    return importer
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Import SBB stations from a stop list")
+    parser.add_argument('stops',
+                        help="GTFS feed (zip), GTFS stops.txt or SBB station CSV")
+    parser.add_argument('--db', default='example.db',
+                        help="path of the station database")
+    args = parser.parse_args()
+    importer = build_station_db(args.stops, args.db)
+    print("%d stations imported, %d outside of Switzerland" % (importer.imported, importer.outside))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import bz2
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+
+try:
+    from urllib.request import pathname2url
+except ImportError:
+    from urllib import pathname2url
+
+from mofa_places.importers.cache import replace
+
+logger = logging.getLogger(__name__)
+
+# memory mapped I/O of read only databases, pages are shared between readers
+READONLY_MMAP_SIZE = 256 * 1024 * 1024
+
+BZ2_MAGIC = b'BZh'
+ZIP_MAGIC = b'PK\x03\x04'
+
+# UPSERT is available from SQLite 3.24
+if sqlite3.sqlite_version_info >= (3, 24, 0):
+    UPSERT_STATION = """INSERT INTO station (id, name, x, y, type, modified)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET name = excluded.name, x = excluded.x,
+                y = excluded.y, type = excluded.type, modified = excluded.modified"""
+else:
+    UPSERT_STATION = """INSERT OR REPLACE INTO station (id, name, x, y, type, modified)
+            VALUES (?, ?, ?, ?, ?, ?)"""
+
+
+def dict_factory(cursor, row):
+    """ Return sqlite data as dict """
+    d = {}
+    for idx,col in enumerate(cursor.description):
+        d[col[0]] = row[idx]
+    return d
+
+
+def connect_readonly(path, mmap_size=READONLY_MMAP_SIZE):
+    """ Open a database which isn't modified while it is read
+
+    The database is opened through an immutable read only URI (no locking,
+    no change detection) and read with memory mapped I/O. Python 2's
+    sqlite3 doesn't accept URIs, the file is opened normally there and
+    the connection made read only with query_only.
+    """
+    uri = 'file:%s?mode=ro&immutable=1' % pathname2url(os.path.abspath(path))
+    try:
+        conn = sqlite3.connect(uri, uri=True)
+    except TypeError:
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA query_only=1")
+    conn.execute("PRAGMA mmap_size=%d" % int(mmap_size))
+    return conn
+
+
+def _open_archive(path):
+    """ File object of the decompressed content of a bz2 or zip archive,
+    None if path isn't an archive
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(BZ2_MAGIC):
+        return bz2.BZ2File(path)
+    if magic == ZIP_MAGIC:
+        archive = zipfile.ZipFile(path)
+        names = [name for name in archive.namelist() if not name.endswith('/')]
+        if len(names) != 1:
+            raise ValueError("%s should contain a single file, not %d" % (path, len(names)))
+        return archive.open(names[0])
+    return None
+
+
+def extract_database(path, chunk_size=1024 * 1024):
+    """ Path of the database of a (possibly compressed) resource
+
+    bz2 and zip archives are decompressed as a stream into path + '.db',
+    which is reused as long as it's newer than the archive; other files
+    are returned unchanged.
+    """
+    source = _open_archive(path)
+    if source is None:
+        return path
+    target = path + '.db'
+    try:
+        if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+            return target
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(source, f, chunk_size)
+            replace(tmp, target)
+        except Exception:
+            os.remove(tmp)
+            raise
+        logger.info("%s extracted to %s", path, target)
+    finally:
+        source.close()
+    return target
+
+
+class StationStore(object):
+    """ SQLite database of stations
+
+    The database is used in WAL mode, stations are written in batches of
+    batch_size with executemany. An R*Tree table (station_rtree) is kept in
+    sync with the station table by triggers, for bounding box lookups.
+    """
+
+    def __init__(self, path, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = []
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = dict_factory
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS station (
+                id INTEGER PRIMARY KEY,
+                name VARCHAR(255),
+                x REAL,
+                y REAL,
+                type VARCHAR(25),
+                modified TEXT
+        )""")
+        self.spatial = self.create_rtree()
+        self.conn.commit()
+
+    def create_rtree(self):
+        """ Create the R*Tree table and its triggers if needed
+
+        :return: False if SQLite has been built without the R*Tree module
+        """
+        exists = self.conn.execute("SELECT name FROM sqlite_master WHERE name = 'station_rtree'").fetchall()
+        if exists:
+            return True
+        try:
+            self.conn.execute("CREATE VIRTUAL TABLE station_rtree USING rtree(id, min_x, max_x, min_y, max_y)")
+        except sqlite3.OperationalError:
+            logger.warning("SQLite R*Tree module not available, bounding box lookups will scan the station table")
+            return False
+        self.conn.execute("""CREATE TRIGGER station_rtree_insert AFTER INSERT ON station BEGIN
+                INSERT OR REPLACE INTO station_rtree VALUES (new.id, new.x, new.x, new.y, new.y);
+        END""")
+        self.conn.execute("""CREATE TRIGGER station_rtree_update AFTER UPDATE OF id, x, y ON station BEGIN
+                DELETE FROM station_rtree WHERE id = old.id;
+                INSERT INTO station_rtree VALUES (new.id, new.x, new.x, new.y, new.y);
+        END""")
+        self.conn.execute("""CREATE TRIGGER station_rtree_delete AFTER DELETE ON station BEGIN
+                DELETE FROM station_rtree WHERE id = old.id;
+        END""")
+        # stations stored before the R*Tree table existed
+        self.conn.execute("INSERT INTO station_rtree SELECT id, x, x, y, y FROM station")
+        return True
+
+    def add(self, station):
+        """ Insert or update a station (written with the next batch) """
+        self.pending.append((station['id'], station['name'], station['x'], station['y'],
+                             station.get('type'), station.get('modified')))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.conn.executemany(UPSERT_STATION, self.pending)
+            self.pending = []
+
+    def commit(self):
+        self.flush()
+        self.conn.commit()
+
+    def delete(self, ids):
+        self.flush()
+        self.conn.executemany("DELETE FROM station WHERE id = ?", [(ident,) for ident in ids])
+
+    def within(self, min_x, min_y, max_x, max_y):
+        """ Stations in a bounding box """
+        self.flush()
+        bounds = {'min_x': min_x, 'min_y': min_y, 'max_x': max_x, 'max_y': max_y}
+        if self.spatial:
+            # R*Tree bounds are float32 rounded outward: find the overlapping
+            # boxes, then compare the exact coordinates
+            sql = """SELECT station.* FROM station JOIN station_rtree ON station.id = station_rtree.id
+                    WHERE station_rtree.max_x >= :min_x AND station_rtree.min_x <= :max_x
+                    AND station_rtree.max_y >= :min_y AND station_rtree.min_y <= :max_y
+                    AND station.x >= :min_x AND station.x <= :max_x
+                    AND station.y >= :min_y AND station.y <= :max_y"""
+        else:
+            sql = """SELECT * FROM station WHERE x >= :min_x AND x <= :max_x
+                    AND y >= :min_y AND y <= :max_y"""
+        return self.conn.execute(sql, bounds).fetchall()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
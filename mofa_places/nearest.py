@@ -0,0 +1,134 @@
+import heapq
+import json
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS = 6371000.0  # meters
+
+# key of the stations published for the index in the KV store
+STATIONS_KEY = 'places.sbb.stations.nearest'
+STATIONS_VERSION_KEY = STATIONS_KEY + '.version'
+
+
+def to_xyz(lon, lat):
+    """ Point on the unit sphere: the chord between two points grows with
+    their great-circle distance, so nearest points can be searched with
+    euclidean distances
+    """
+    lon = math.radians(lon)
+    lat = math.radians(lat)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def chord_to_meters(chord):
+    return 2 * EARTH_RADIUS * math.asin(min(chord / 2, 1.0))
+
+
+def meters_to_chord(meters):
+    return 2 * math.sin(min(meters / (2 * EARTH_RADIUS), math.pi / 2))
+
+
+class StationIndex(object):
+    """ KD-tree of stations for nearest neighbour and radius queries
+
+    :param stations: list of (id, name, longitude, latitude)
+    """
+
+    def __init__(self, stations):
+        self.stations = stations
+        self.points = [to_xyz(s[2], s[3]) for s in stations]
+        self.root = self.build(list(range(len(stations))), 0)
+
+    def build(self, indices, depth):
+        if not indices:
+            return None
+        axis = depth % 3
+        points = self.points
+        indices.sort(key=lambda i: points[i][axis])
+        median = len(indices) // 2
+        return (indices[median], axis,
+                self.build(indices[:median], depth + 1),
+                self.build(indices[median + 1:], depth + 1))
+
+    def nearest(self, lon, lat, count=10, radius=None):
+        """ Stations closest to a point
+
+        :param count: maximum number of stations
+        :param radius: maximum distance in meters
+        :return: list of (distance in meters, station) sorted by distance
+        """
+        if count <= 0 or self.root is None:
+            return []
+        target = to_xyz(lon, lat)
+        limit = meters_to_chord(radius) ** 2 if radius is not None else float('inf')
+        heap = []   # (-squared distance, index) of the best candidates
+
+        def search(node):
+            index, axis, left, right = node
+            point = self.points[index]
+            distance = ((point[0] - target[0]) ** 2 + (point[1] - target[1]) ** 2
+                        + (point[2] - target[2]) ** 2)
+            if distance <= limit:
+                if len(heap) < count:
+                    heapq.heappush(heap, (-distance, index))
+                elif distance < -heap[0][0]:
+                    heapq.heapreplace(heap, (-distance, index))
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            if near is not None:
+                search(near)
+            worst = -heap[0][0] if len(heap) == count else limit
+            if far is not None and diff * diff <= worst:
+                search(far)
+
+        search(self.root)
+        return [(chord_to_meters(math.sqrt(-d)), self.stations[i])
+                for d, i in sorted(heap, reverse=True)]
+
+
+def publish_stations(kv, stations):
+    """ Publish stations (id, name, longitude, latitude) for the indexes
+    of all processes, which are rebuilt on their next check
+    """
+    kv.set(STATIONS_KEY, json.dumps(stations))
+    kv.set(STATIONS_VERSION_KEY, repr(time.time()))
+
+
+class StationIndexLoader(object):
+    """ Keep a StationIndex built from the stations published in kv
+
+    The version of the published stations is checked at most every
+    check_interval seconds; a new index is built when it changed and
+    replaces the previous one, queries in progress keep using the old one.
+    """
+
+    def __init__(self, kv, check_interval=60):
+        self.kv = kv
+        self.check_interval = check_interval
+        self.index = None
+        self.version = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        if time.time() - self.checked >= self.check_interval:
+            with self.lock:
+                if time.time() - self.checked >= self.check_interval:
+                    self.refresh()
+        return self.index
+
+    def refresh(self):
+        self.checked = time.time()
+        version = self.kv.get(STATIONS_VERSION_KEY)
+        if version is None or version == self.version:
+            return
+        stations = self.kv.get(STATIONS_KEY)
+        if stations is None:
+            return
+        self.index = StationIndex(json.loads(stations))
+        self.version = version
+        logger.info("Nearest stations index rebuilt (%d stations)", len(self.index.stations))
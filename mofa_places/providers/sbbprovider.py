@@ -1,10 +1,11 @@
+from __future__ import print_function
+
 import logging
 import requests
-from requests import RequestException
-from lxml import etree
-from datetime import datetime, date, time
 
-from moxie_sbb.domain import Station
+from mofa_places.domain import Station
+from mofa_places.importers.sbb_stations import STATIONBOARD_URL
+from mofa_places.importers.stationboard import iter_stations
 
 logger = logging.getLogger(__name__)
 
@@ -19,28 +20,35 @@ class DefaultSbbProvider(object):
     provides = {'rail-departures': "Departures",
                 'rail-arrivals': "Arrivals"}
 
-    def __init__(self, max_services=15):
+    def __init__(self, max_services=15, url=STATIONBOARD_URL, station=8503000,
+                 distance=50, chunk_size=16 * 1024, timeout=30):
         self._max_services = max_services
+        self.url = url
+        # station whose "stations near" page is imported
+        self.station = station
+        self.distance = distance
+        self.chunk_size = chunk_size
+        self.timeout = timeout
 
     def import_data(self):
-        r = requests.get(self.url)
-        return iter(self._scrape_json(r.text.encode('utf-8', 'ignore')))
-
-    def _scrape_xml(self, content):
-        parser = etree.HTMLParser(encoding='utf-8')
-        root = etree.fromstring(content, parser)
-
-        raise NotImplementedError
-        for offer in root.iterfind('.//div[@class="offer"]'):
-            obj = Station()
-            #obj.name = offer.find('.//div[@class="title"]').text.strip()
-            #description = offer.find('.//div[@class="trimmings"]')
-            #obj.description = ' '.join(etree.tostring(
-            #     description, method='text', encoding='utf-8').splitlines())
-            yield obj
+        """ Stations near self.station, yielded while the page is received """
+        r = requests.get(self.url, params={'distance': self.distance,
+                                           'input': self.station,
+                                           'near': 'Anzeigen'},
+                         stream=True, timeout=self.timeout)
+        try:
+            r.raise_for_status()
+            for station in self._scrape_xml(r.iter_content(self.chunk_size), r.url):
+                yield station
+        finally:
+            r.close()
+
+    def _scrape_xml(self, chunks, source=None):
+        for data in iter_stations(chunks, source):
+            yield Station(**data)
 
 
 if __name__ == '__main__':
-   provider = DefaultSbbProviderProvider()
+   provider = DefaultSbbProvider()
    for x in provider.import_data():
       print(x.as_dict())
@@ -1,19 +1,57 @@
-from flask import url_for, jsonify
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import url_for, json, request, Response
 
 from moxie.core.representations import HALRepresentation
 
 
+class RepresentationCache(object):
+    """ Encoded representations, keyed by (endpoint, last_updated)
+
+    The data of a representation only changes with last_updated, it is
+    serialized once and served from memory until then. The max_entries
+    least recently used representations are kept.
+    """
+
+    def __init__(self, max_entries=100):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, encode):
+        """ (body, etag) of the representation of key, encoded by encode()
+        if it isn't cached
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+                return entry
+        body = encode()
+        entry = (body, hashlib.sha1(body).hexdigest())
+        with self.lock:
+            self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+
+representations = RepresentationCache()
+
+
 class HALFoodRepresentation(object):
 
-    def __init__(self, <XXX>, attribution, last_updated, endpoint):
-        self.<XXX> = <XXX>
+    def __init__(self, stations, attribution, last_updated, endpoint):
+        self.stations = stations
         self.attribution = attribution
         self.last_updated = last_updated
         self.endpoint = endpoint
 
     def as_dict(self):
         values = {}
-        values[<XXX>] = <XXX>
+        values['stations'] = self.stations
         values['_attribution'] = self.attribution
         values['_last_updated'] = self.last_updated
         representation = HALRepresentation(values)
@@ -21,4 +59,12 @@ class HALFoodRepresentation(object):
         return representation.as_dict()
 
     def as_json(self):
-        return jsonify(self.as_dict())
+        """ JSON response with a strong ETag, 304 if the client has it """
+        key = (self.endpoint, self.last_updated)
+        body, etag = representations.get(key, lambda: json.dumps(self.as_dict()).encode('utf-8'))
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        return response
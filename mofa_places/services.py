@@ -1,5 +1,12 @@
+from moxie.core.kv import kv_store
 from moxie.transport.services import TransportService as BaseTransportService
 
+from mofa_places.nearest import StationIndexLoader
+
+# index of the stations published by the last import, shared by the
+# services of the process
+stations_index = StationIndexLoader(kv_store)
+
 
 class TransportService(BaseTransportService):
 
@@ -8,3 +15,22 @@ class TransportService(BaseTransportService):
 
     def import_park_and_ride(self):
        pass
+
+    def get_nearest_stations(self, lat, lon, count=10, radius=None):
+        """ Stations closest to a point, from the in-memory index
+
+        :param count: maximum number of stations
+        :param radius: maximum distance in meters
+        :return: list of dicts (id, name, lat, lon, distance in meters)
+                 sorted by distance
+        """
+        index = stations_index.get()
+        if index is None:
+            return []
+        return [{'id': "stoparea:%s" % ident,
+                 'name': name,
+                 'lat': station_lat,
+                 'lon': station_lon,
+                 'distance': int(round(distance))}
+                for distance, (ident, name, station_lon, station_lat)
+                in index.nearest(lon, lat, count, radius)]
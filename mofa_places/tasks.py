@@ -1,24 +1,118 @@
+import hashlib
+import json
 import logging
-import bz2
-import zipfile
 import requests
 
-from celery import chain
+from celery import chain, chord
 from xml.sax import make_parser
 
 from moxie import create_app
 from moxie.worker import celery
 from moxie.core.tasks import get_resource
-from moxie.core.search import searcher
+from moxie.core.search import searcher, SearchService
 from moxie.core.kv import kv_store
-from mofa_places.importers.sbb import SbbStationImporter
+from mofa_places.importers.sbb import SbbStationImporter, read_stations, dict_factory
+from mofa_places.importers.indexing import AdaptiveBatchSize, commit_policy
+from mofa_places.importers.store import connect_readonly, extract_database
+from mofa_places.importers.stops import build_station_db
+from mofa_places.nearest import publish_stations
+from mofa_places.transport.cache import save_board, top_hits
+from mofa_places.transport.sbb import SbbRtiProvider, HITS_KEY, board_key
 
 logger = logging.getLogger(__name__)
 BLUEPRINT_NAME = 'places'
 
+# content hashes of the stations in the production core
+SBB_CHECKPOINT_KEY = 'places.sbb.stations.checkpoint'
+# content hashes of the stations in the staging core, waiting for the swap
+SBB_PENDING_CHECKPOINT_KEY = 'places.sbb.stations.checkpoint.pending'
+# stations for the nearest stations index, published when the cores are swapped
+SBB_PENDING_STATIONS_KEY = 'places.sbb.stations.nearest.pending'
+# checksum, ETag and Last-Modified of an imported resource
+RESOURCE_STATE_KEY = 'places.resources.{url_hash}'
+# url and state of the resource imported in the staging core
+PENDING_RESOURCE_STATE_KEY = 'places.resources.pending'
+
+
+def load_checkpoint(key):
+    value = kv_store.get(key)
+    if value:
+        return json.loads(value)
+    return None
+
+
+def save_checkpoint(key, hashes):
+    kv_store.set(key, json.dumps(hashes))
+
+
+def resource_key(url):
+    return RESOURCE_STATE_KEY.format(url_hash=hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+
+def file_checksum(path):
+    checksum = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def check_resource(url, timeout=30):
+    """ Find out whether a resource changed since its last import
+
+    A conditional request with the ETag and Last-Modified of the last
+    import is made first; if the server doesn't answer 304, the resource
+    is downloaded (get_resource) and its checksum compared.
+
+    :return: (changed, state of the resource, path of the downloaded
+             resource or None), the path is meant to be passed to the
+             importers so that the resource isn't downloaded again
+    """
+    previous = load_checkpoint(resource_key(url)) or {}
+    headers = {}
+    if previous.get('etag'):
+        headers['If-None-Match'] = previous['etag']
+    if previous.get('last_modified'):
+        headers['If-Modified-Since'] = previous['last_modified']
+    state = {}
+    try:
+        response = requests.get(url, headers=headers, stream=True, timeout=timeout)
+        response.close()
+        if response.status_code == 304:
+            return False, previous, None
+        state['etag'] = response.headers.get('ETag')
+        state['last_modified'] = response.headers.get('Last-Modified')
+    except requests.RequestException:
+        logger.warning("Conditional request for %s failed", url, exc_info=True)
+    path = get_resource(url, False)
+    if not path:
+        return True, state, None
+    state['checksum'] = file_checksum(path)
+    if state['checksum'] == previous.get('checksum'):
+        # same content, the validators may have changed
+        save_checkpoint(resource_key(url), state)
+        return False, state, path
+    return True, state, path
+
+
+def nearest_stations(db):
+    """ Stations of the SBB DB for the nearest stations index """
+    conn = connect_readonly(db)
+    conn.row_factory = dict_factory
+    try:
+        return [(row['id'], row['name'], row['x'], row['y']) for row in read_stations(conn)]
+    finally:
+        conn.close()
+
+
+def solr_update(update_url, body):
+    """ POST an XML update message (delete, commit...) to a Solr core """
+    response = requests.post(update_url, body, headers={'Content-type': 'text/xml'})
+    return response.ok
+
 
 @celery.task
-def import_all(force_update_all=False):
+def import_all(force_update_all=False, incremental=False):
     app = create_app()
     with app.blueprint_context(BLUEPRINT_NAME):
 
@@ -27,6 +121,37 @@ def import_all(force_update_all=False):
         staging_core = app.config['PLACES_SOLR_CORE_STAGING']
         production_core = app.config['PLACES_SOLR_CORE_PRODUCTION']
 
+        if incremental and kv_store.get(SBB_CHECKPOINT_KEY):
+            # changes are applied to the production core in place,
+            # no need to rebuild the staging core and swap
+            logger.info("Launching incremental import")
+            if app.config.get('SBB_STOPS_URL'):
+                # compared with the checkpoint of the full imports, which
+                # are built from the stop list as well
+                stops_db = app.config['SBB_STOPS_DB']
+                chain(import_sbb_stops.s(force_update=force_update_all, db=stops_db),
+                      import_sbb_stations.s(force_update=force_update_all, incremental=True,
+                                            db=stops_db))()
+            else:
+                import_sbb_stations.delay(force_update=force_update_all, incremental=True)
+            return
+
+        pending = None
+        resource = None
+        if not force_update_all:
+            resource_url = app.config.get('SBB_STOPS_URL') or app.config['SBB_IMPORT_URL']
+            changed, state, resource = check_resource(resource_url)
+            if not changed:
+                logger.info("%s unchanged since the last import, import skipped", resource_url)
+                return
+            if resource is None:
+                # nothing to import, keep the staging core as it is
+                logger.warning("%s not loaded, import aborted", resource_url)
+                return
+            pending = {'url': resource_url, 'state': state}
+        # recorded when the cores are swapped
+        kv_store.set(PENDING_RESOURCE_STATE_KEY, json.dumps(pending))
+
         staging_core_url = '{server}/{core}/update'.format(server=solr_server, core=staging_core)
 
         delete_response = requests.post(staging_core_url, '<delete><query>*:*</query></delete>', headers={'Content-type': 'text/xml'})
@@ -34,43 +159,171 @@ def import_all(force_update_all=False):
 
         if delete_response.ok and commit_response.ok:
             logger.info("Deleted all documents from staging, launching importers")
-            # Using a chain (seq) so tasks execute in order
-            res = chain(#import_osm.s(force_update=force_update_all),
-                        import_sbb_stations.s(force_update=force_update_all),
-                        #import_swiss_library_data.s(force_update=force_update_all)
-            )()
-            res.get() # Get will block until all tasks complete
-            if all([r[1] for r in res.collect()]):    # if all results are True
-                swap_response = requests.get("{server}/admin/cores?action=SWAP&core={new}&other={old}".format(server=solr_server,
-                                                                                                              new=production_core,
-                                                                                                              old=staging_core))
-                if swap_response.ok:
-                    logger.info("Cores swapped")
-                else:
-                    logger.warning("Error when swapping core {response}".format(response=swap_response.status_code))
+            # importers are independent and run in parallel, cores are swapped
+            # by a callback once all of them completed (nothing blocks waiting)
+            if app.config.get('SBB_STOPS_URL'):
+                # station DB built from the published stop list
+                stops_db = app.config['SBB_STOPS_DB']
+                sbb_stations = chain(import_sbb_stops.s(force_update=force_update_all, db=stops_db,
+                                                        stops=resource),
+                                     import_sbb_stations.s(force_update=force_update_all, db=stops_db))
             else:
-                logger.warning("Didn't swap cores because some errors happened")
+                # resource already downloaded by check_resource (None if forced)
+                sbb_stations = import_sbb_stations.s(force_update=force_update_all, db=resource)
+            chord([#import_osm.s(force_update=force_update_all),
+                   sbb_stations,
+                   #import_swiss_library_data.s(force_update=force_update_all)
+            ])(swap_cores.s())
         else:
             logger.warning("Staging core not deleted correctly, aborting")
 
 
 @celery.task
-def import_sbb_stations(previous_result=None, url=None, force_update=False):
+def swap_cores(results):
+    """ Swap the staging and production cores if all importers succeeded
+
+    :param results: results of the importers
+    """
+    if not all(results):
+        logger.warning("Didn't swap cores because some errors happened")
+        return False
+    app = create_app()
+    with app.blueprint_context(BLUEPRINT_NAME):
+        solr_server = app.config['PLACES_SOLR_SERVER']
+        staging_core = app.config['PLACES_SOLR_CORE_STAGING']
+        production_core = app.config['PLACES_SOLR_CORE_PRODUCTION']
+        swap_response = requests.get("{server}/admin/cores?action=SWAP&core={new}&other={old}".format(server=solr_server,
+                                                                                                      new=production_core,
+                                                                                                      old=staging_core))
+        if swap_response.ok:
+            logger.info("Cores swapped")
+            hashes = load_checkpoint(SBB_PENDING_CHECKPOINT_KEY)
+            if hashes is not None:
+                save_checkpoint(SBB_CHECKPOINT_KEY, hashes)
+            pending = load_checkpoint(PENDING_RESOURCE_STATE_KEY)
+            if pending is not None:
+                save_checkpoint(resource_key(pending['url']), pending['state'])
+            stations = load_checkpoint(SBB_PENDING_STATIONS_KEY)
+            if stations is not None:
+                publish_stations(kv_store, stations)
+            return True
+        else:
+            logger.warning("Error when swapping core {response}".format(response=swap_response.status_code))
+            return False
+
+
+@celery.task
+def import_sbb_stops(previous_result=None, url=None, force_update=False, db=None, stops=None):
+    """ Build the SBB station DB from the published stop list (GTFS
+    stops.txt or SBB station CSV) instead of crawling the station pages
+
+    stops is the path of the stop list if it has already been downloaded.
+    """
     if previous_result not in [None, True]:
         return False
     app = create_app()
     with app.blueprint_context(BLUEPRINT_NAME):
-        url = url or app.config['SBB_IMPORT_URL']
-        db = get_resource(url, force_update)
+        url = url or app.config['SBB_STOPS_URL']
+        db = db or app.config['SBB_STOPS_DB']
+        stops = stops or get_resource(url, force_update)
+        if stops:
+            importer = build_station_db(stops, db)
+            logger.info("SBB station DB built: %d stations (%d outside of Switzerland)",
+                        importer.imported, importer.outside)
+        else:
+            logger.info("SBB stops haven't been imported - resource not loaded")
+            return False
+    return True
+
+
+@celery.task
+def import_sbb_stations(previous_result=None, url=None, force_update=False, incremental=False, db=None):
+    """ Import SBB stations
+
+    With incremental, only stations added or changed since the last import
+    are indexed and stations which disappeared are deleted, directly in the
+    production core. db is the path of a station DB (or of its archive)
+    to import instead of the resource at url, e.g. built by
+    import_sbb_stops or already downloaded.
+    """
+    if previous_result not in [None, True]:
+        return False
+    app = create_app()
+    with app.blueprint_context(BLUEPRINT_NAME):
+        if not db:
+            url = url or app.config['SBB_IMPORT_URL']
+            db = get_resource(url, force_update)
         if db:
-            sbb_importer = SbbStationImporter(searcher, 10, db, ['340'], 'identifiers')
+            # the DB may be published compressed (bz2 or zip)
+            db = extract_database(db)
+            indexer = searcher
+            checkpoint = None
+            if incremental:
+                checkpoint = load_checkpoint(SBB_CHECKPOINT_KEY)
+                if checkpoint is None:
+                    logger.info("SBB stations haven't been imported - no checkpoint for an incremental import")
+                    return False
+                core_url = '{server}/{core}'.format(server=app.config['PLACES_SOLR_SERVER'],
+                                                    core=app.config['PLACES_SOLR_CORE_PRODUCTION'])
+                indexer = SearchService('solr+' + core_url)
+            bulk_url = None
+            if not incremental and app.config.get('SBB_IMPORT_BULK', False):
+                bulk_url = '{server}/{core}/update'.format(server=app.config['PLACES_SOLR_SERVER'],
+                                                         core=app.config['PLACES_SOLR_CORE_STAGING'])
+            policy = commit_policy(*app.config.get('SBB_IMPORT_COMMIT_POLICY', ('end',)))
+            sbb_importer = SbbStationImporter(indexer, 10, db, ['340'], 'identifiers',
+                                              batch_size=AdaptiveBatchSize(),
+                                              commit_policy=policy,
+                                              checkpoint=checkpoint,
+                                              workers=app.config.get('SBB_IMPORT_INDEX_WORKERS', 0),
+                                              bulk_url=bulk_url)
             sbb_importer.run()
+            if sbb_importer.failed:
+                logger.warning("SBB stations import failed - %d stations not indexed", sbb_importer.failed)
+                return False
+            if incremental:
+                if sbb_importer.removed:
+                    ids = ''.join('<id>stoparea:%s</id>' % ident for ident in sbb_importer.removed)
+                    update_url = core_url + '/update'
+                    if not (solr_update(update_url, '<delete>%s</delete>' % ids)
+                            and solr_update(update_url, '<commit/>')):
+                        logger.warning("Removed SBB stations not deleted correctly")
+                        return False
+                logger.info("SBB stations updated: %d stations removed", len(sbb_importer.removed))
+                save_checkpoint(SBB_CHECKPOINT_KEY, sbb_importer.hashes)
+                publish_stations(kv_store, nearest_stations(db))
+            else:
+                # the staging core isn't in production until it is swapped
+                save_checkpoint(SBB_PENDING_CHECKPOINT_KEY, sbb_importer.hashes)
+                save_checkpoint(SBB_PENDING_STATIONS_KEY, nearest_stations(db))
         else:
             logger.info("SBB stations haven't been imported - resource not loaded")
             return False
     return True
 
 
+@celery.task
+def prefetch_departure_boards(top=None):
+    """ Refresh the departure boards requested the most
+
+    Meant to run periodically (e.g. every 30 seconds from celerybeat),
+    more often than SbbRtiProvider's prefetch_max_age, so that boards are
+    refreshed before they expire.
+    """
+    app = create_app()
+    with app.blueprint_context(BLUEPRINT_NAME):
+        top = top or app.config.get('SBB_RTI_PREFETCH_TOP', 20)
+        provider = SbbRtiProvider(None)
+        for name in top_hits(kv_store, HITS_KEY, top):
+            sbb_code, limit = name.split(':')
+            try:
+                board = provider.fetch_departure_board(sbb_code, int(limit))
+            except Exception:
+                logger.warning("Departure board of %s not prefetched", sbb_code, exc_info=True)
+                continue
+            save_board(kv_store, board_key(sbb_code, limit), board)
+
+
 @celery.task
 def import_swiss_library_data(previous_result=None, url=None, force_update=False):
     if previous_result not in [None, True]:
@@ -0,0 +1,70 @@
+""" Stand-ins for the parts of moxie (and flask) imported by the modules
+under test, installed only when they aren't available. The tests replace
+what they use (kv_store, statsd, prepare_document...) with their own
+fakes.
+"""
+import sys
+import types
+from contextlib import contextmanager
+
+
+class TransportRTIProvider(object):
+    pass
+
+
+class HALRepresentation(object):
+
+    def __init__(self, values):
+        self.values = dict(values)
+        self.links = {}
+
+    def add_link(self, rel, href):
+        self.links[rel] = {'href': href}
+
+    def as_dict(self):
+        values = dict(self.values)
+        values['_links'] = self.links
+        return values
+
+
+@contextmanager
+def override_loglevel(level):
+    yield
+
+
+STUBS = {
+    'moxie.places.importers.helpers': {'prepare_document': None},
+    'moxie.core.kv': {'kv_store': None},
+    'moxie.core.metrics': {'statsd': None},
+    'moxie.core.representations': {'HALRepresentation': HALRepresentation},
+    'moxie.transport.providers': {'TransportRTIProvider': TransportRTIProvider},
+    'moxie.transport.providers.ldb': {'override_loglevel': override_loglevel},
+}
+
+
+FLASK_STUBS = {
+    'flask': {'current_app': None,
+              'copy_current_request_context': lambda func: func,
+              'has_app_context': lambda: False,
+              'has_request_context': lambda: False},
+}
+
+
+def install():
+    try:
+        import flask
+    except ImportError:
+        _install(FLASK_STUBS)
+    try:
+        import moxie
+    except ImportError:
+        _install(STUBS)
+
+
+def _install(stubs):
+    for module, attributes in stubs.items():
+        parts = module.split('.')
+        for i in range(1, len(parts) + 1):
+            sys.modules.setdefault('.'.join(parts[:i]), types.ModuleType('.'.join(parts[:i])))
+        for name, value in attributes.items():
+            setattr(sys.modules[module], name, value)
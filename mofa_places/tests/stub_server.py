@@ -0,0 +1,42 @@
+import threading
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+
+class StubServer(object):
+    """ HTTP server running in a thread for the duration of a test
+
+    handler is a BaseHTTPRequestHandler subclass, the server is available
+    to it as self.server and keeps the requests made in server.requests.
+    """
+
+    def __init__(self, handler):
+        self.httpd = HTTPServer(('127.0.0.1', 0), handler)
+        self.httpd.requests = []
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.httpd.server_port
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
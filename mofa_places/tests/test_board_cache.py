@@ -0,0 +1,105 @@
+import threading
+import time
+import unittest
+
+from mofa_places.transport.cache import BoardCache, HitCounter, top_hits, save_board, load_board
+
+
+class DictKV(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+
+class BoardCacheTest(unittest.TestCase):
+    """
+    Tests for the short-lived departure board cache
+    """
+
+    def test_ttl(self):
+        now = [1000.0]
+        cache = BoardCache(ttl=15, clock=lambda: now[0])
+        calls = []
+
+        def fetch():
+            calls.append(now[0])
+            return len(calls)
+        self.assertEqual(cache.get(('8503000', 15), fetch), 1)
+        now[0] += 10
+        self.assertEqual(cache.get(('8503000', 15), fetch), 1)
+        self.assertEqual(cache.get(('8503000', 5), fetch), 2)
+        now[0] += 10
+        self.assertEqual(cache.get(('8503000', 15), fetch), 3)
+
+    def test_coalesce(self):
+        cache = BoardCache(ttl=15)
+        calls = []
+        results = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'board'
+
+        def request():
+            results.append(cache.get(('8503000', 15), fetch))
+        threads = [threading.Thread(target=request) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['board'] * 10)
+
+    def test_error(self):
+        cache = BoardCache(ttl=15)
+
+        def fail():
+            raise IOError("timeout")
+        self.assertRaises(IOError, cache.get, 'key', fail)
+        self.assertEqual(cache.get('key', lambda: 'board'), 'board')
+
+    def test_max_entries(self):
+        now = [1000.0]
+        cache = BoardCache(ttl=15, max_entries=3, clock=lambda: now[0])
+        for key in 'abcd':
+            cache.set(key, key)
+            now[0] += 1
+        self.assertEqual(list(cache.entries), ['b', 'c', 'd'])
+        cache.set('b', 'b')
+        cache.set('e', 'e')
+        self.assertEqual(list(cache.entries), ['d', 'b', 'e'])
+        # expired entries are only evicted when there's no room left
+        now[0] += 30
+        self.assertEqual(cache.stale('d'), 'd')
+        cache.set('f', 'f')
+        self.assertEqual(list(cache.entries), ['b', 'e', 'f'])
+        self.assertEqual(cache.stale('b'), 'b')
+        self.assertEqual(cache.get('b', lambda: 'fresh b'), 'fresh b')
+
+    def test_hits(self):
+        kv = DictKV()
+        now = [1000.0]
+        counter = HitCounter(kv, 'hits', flush_interval=60, clock=lambda: now[0])
+        for name in ['8503000:15'] * 4 + ['8500010:15'] * 3 + ['8503006:15']:
+            counter.hit(name)
+        self.assertFalse('hits' in kv)
+        now[0] += 60
+        counter.hit('8503006:15')
+        self.assertEqual(top_hits(kv, 'hits', 2), ['8503000:15', '8500010:15'])
+        # counts are halved, then dropped under 1
+        self.assertEqual(top_hits(kv, 'hits', 5), ['8503000:15', '8500010:15', '8503006:15'])
+        self.assertEqual(top_hits(kv, 'hits', 5), ['8503000:15'])
+        self.assertEqual(top_hits(kv, 'hits', 5), [])
+
+    def test_top_hits_ties(self):
+        kv = DictKV()
+        kv.set('hits', '{"8503006:15": 2, "8500010:15": 2, "8503000:15": 3}')
+        self.assertEqual(top_hits(kv, 'hits', 2), ['8503000:15', '8500010:15'])
+
+    def test_prefetched_board(self):
+        kv = DictKV()
+        save_board(kv, 'board', ([{'to': u'Gen\xe8ve'}], []))
+        self.assertEqual(load_board(kv, 'board', 60), ([{'to': u'Gen\xe8ve'}], []))
+        self.assertEqual(load_board(kv, 'board', -1), None)
+        self.assertEqual(load_board(kv, 'other', 60), None)
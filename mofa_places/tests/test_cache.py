@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mofa_places.importers.cache import PageCache
+
+
+class PageCacheTest(unittest.TestCase):
+    """
+    Tests for the compressed, sharded page cache
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_get_set(self):
+        cache = PageCache(self.tmp)
+        self.assertEqual(cache.get('8503000'), None)
+        content = b'<html>' + b'Z\xc3\xbcrich HB' * 100 + b'</html>'
+        cache.set('8503000', content, etag='"abc"')
+        page = cache.get('8503000')
+        self.assertEqual(page.content, content)
+        self.assertTrue(page.fresh)
+        self.assertEqual(page.validators(), {'If-None-Match': '"abc"'})
+        path = cache.path('8503000')
+        self.assertEqual(os.path.relpath(path, self.tmp).count(os.sep), 2)
+        self.assertTrue(os.path.getsize(path) < len(content))
+
+    def test_ttl(self):
+        cache = PageCache(self.tmp, ttl=60)
+        cache.set('8503000', b'page', last_modified='Sat, 17 Oct 2026 10:00:00 GMT')
+        old = time.time() - 120
+        os.utime(cache.path('8503000'), (old, old))
+        page = cache.get('8503000')
+        self.assertFalse(page.fresh)
+        self.assertEqual(page.validators(),
+                         {'If-Modified-Since': 'Sat, 17 Oct 2026 10:00:00 GMT'})
+        cache.touch('8503000')
+        self.assertTrue(cache.get('8503000').fresh)
+
+    def test_max_size(self):
+        cache = PageCache(self.tmp, max_size=2000)
+        for i in range(20):
+            cache.set(str(i), os.urandom(200))
+            old = time.time() - 100 + i
+            os.utime(cache.path(str(i)), (old, old))
+        self.assertTrue(sum(size for _, _, size in cache.entries()) <= 2000)
+        self.assertEqual(cache.get('0'), None)
+        self.assertNotEqual(cache.get('19'), None)
@@ -0,0 +1,75 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from mofa_places import geofence
+from mofa_places.geofence import (swiss_contour, load_index, in_switzerland,
+                                  PolygonIndex, CONTOUR_CH)
+
+
+class SwissContourTest(unittest.TestCase):
+    """
+    Tests for the geofence of Switzerland
+    """
+
+    def setUp(self):
+        self.polygon = swiss_contour()
+        rnd = random.Random(42)
+        self.xs = [rnd.uniform(5.5, 11.0) for _ in range(2000)]
+        self.ys = [rnd.uniform(45.5, 48.0) for _ in range(2000)]
+
+    def test_contains_point(self):
+        self.assertTrue(self.polygon.contains_point({'x': 8.540192, 'y': 47.378177}))  # Zurich HB
+        self.assertTrue(self.polygon.contains_point({'x': 8.950, 'y': 46.005}))  # Lugano
+        self.assertFalse(self.polygon.contains_point({'x': 9.181636, 'y': 48.784081}))  # Stuttgart
+        self.assertFalse(self.polygon.contains_point({'x': 9.085, 'y': 45.810}))  # Como
+
+    def test_contains_points(self):
+        expected = [self.polygon.contains_point({'x': x, 'y': y})
+                    for x, y in zip(self.xs, self.ys)]
+        self.assertEqual(self.polygon.contains_points(self.xs, self.ys), expected)
+        self.assertTrue(0 < sum(expected) < len(expected))
+
+    def test_contains_points_without_numpy(self):
+        numpy, geofence.numpy = geofence.numpy, None
+        try:
+            expected = [self.polygon.contains_point({'x': x, 'y': y})
+                        for x, y in zip(self.xs, self.ys)]
+            self.assertEqual(self.polygon.contains_points(self.xs, self.ys), expected)
+        finally:
+            geofence.numpy = numpy
+
+    def test_index(self):
+        expected = self.polygon.contains_points(self.xs, self.ys)
+        index = PolygonIndex.from_polygon(self.polygon)
+        self.assertEqual(index.contains_points(self.xs, self.ys), expected)
+
+    def test_in_switzerland(self):
+        tmp = tempfile.mkdtemp()
+        cache_dir, geofence.CACHE_DIR = geofence.CACHE_DIR, os.path.join(tmp, 'cache')
+        geofence._swiss_contour_index = None
+        try:
+            self.assertTrue(in_switzerland(8.540192, 47.378177))
+            self.assertFalse(in_switzerland(9.181636, 48.784081))
+            self.assertEqual(os.listdir(geofence.CACHE_DIR), ['contour_ch_wgs84.idx'])
+        finally:
+            geofence.CACHE_DIR = cache_dir
+            geofence._swiss_contour_index = None
+            shutil.rmtree(tmp)
+
+    def test_cached_index(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'contour.idx')
+            built = load_index(CONTOUR_CH, path)
+            self.assertTrue(os.path.exists(path))
+            loaded = load_index(CONTOUR_CH, path)
+            self.assertEqual(loaded.ys, built.ys)
+            self.assertEqual(loaded.offsets, built.offsets)
+            self.assertEqual(loaded.edges, built.edges)
+            self.assertEqual(loaded.contains_points(self.xs, self.ys),
+                             self.polygon.contains_points(self.xs, self.ys))
+        finally:
+            shutil.rmtree(tmp)
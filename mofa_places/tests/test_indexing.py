@@ -0,0 +1,156 @@
+import json
+import unittest
+
+from mofa_places.importers.indexing import (BatchIndexer, CommitAtEnd, CommitEvery,
+                                            CommitWithin, AdaptiveBatchSize,
+                                            ThreadedBatchIndexer, StreamingIndexer)
+from mofa_places.tests.stub_server import StubServer, QuietHandler
+
+
+class RecordingIndexer(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def index(self, docs, params=None):
+        self.calls.append(('index', len(docs), params))
+
+    def commit(self):
+        self.calls.append(('commit',))
+
+
+class FailingIndexer(RecordingIndexer):
+
+    def index(self, docs, params=None):
+        if 13 in docs:
+            raise IOError("connection reset")
+        super(FailingIndexer, self).index(docs, params)
+
+
+class BatchIndexerTest(unittest.TestCase):
+    """
+    Tests for the batching indexing sink and its commit policies
+    """
+
+    def test_commit_at_end(self):
+        indexer = RecordingIndexer()
+        BatchIndexer(indexer, 2, CommitAtEnd()).consume(range(5))
+        self.assertEqual(indexer.calls,
+                         [('index', 2, None), ('index', 2, None), ('index', 1, None), ('commit',)])
+
+    def test_commit_every(self):
+        indexer = RecordingIndexer()
+        BatchIndexer(indexer, 2, CommitEvery(4)).consume(range(5))
+        self.assertEqual(indexer.calls,
+                         [('index', 2, None), ('index', 2, None), ('commit',),
+                          ('index', 1, None), ('commit',)])
+
+    def test_commit_within(self):
+        indexer = RecordingIndexer()
+        BatchIndexer(indexer, 3, CommitWithin(5000)).consume(range(3))
+        self.assertEqual(indexer.calls, [('index', 3, {'commitWithin': 5000}), ('commit',)])
+
+    def test_adaptive_batch_size(self):
+        size = AdaptiveBatchSize(size=100, minimum=50, maximum=150, target=1.0)
+        size.update(100, 0.1)
+        self.assertEqual(size.size, 150)
+        size.update(150, 4.0)
+        self.assertEqual(size.size, 75)
+        size.update(10, 4.0)
+        self.assertEqual(size.size, 75)
+        size.update(75, 10.0)
+        self.assertEqual(size.size, 50)
+
+    def test_threaded(self):
+        indexer = FailingIndexer()
+        sink = ThreadedBatchIndexer(indexer, 10, CommitAtEnd(), workers=3, queue_size=1)
+        sink.consume(range(95))
+        self.assertEqual(sink.indexed, 85)
+        self.assertEqual(sink.failed, 10)
+        self.assertEqual(sorted(call[1] for call in indexer.calls[:-1]), [5] + [10] * 8)
+        self.assertEqual(indexer.calls[-1], ('commit',))
+
+    def test_threaded_failing_documents(self):
+        def docs():
+            for i in range(25):
+                yield i
+            raise IOError("search failed")
+        indexer = RecordingIndexer()
+        sink = ThreadedBatchIndexer(indexer, 10, CommitAtEnd(), workers=3)
+        self.assertRaises(IOError, sink.consume, docs())
+        self.assertFalse(any(worker.is_alive() for worker in sink.workers))
+        self.assertEqual(sink.indexed, 20)
+        self.assertFalse(('commit',) in indexer.calls)
+
+
+class SolrUpdateHandler(QuietHandler):
+    """ Stand-in for Solr's update handler, rejecting documents without a name """
+
+    def do_POST(self):
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            chunk = self.rfile.read(size + 2)[:size]
+            if not size:
+                break
+            chunks.append(chunk)
+        docs = json.loads(b''.join(chunks).decode('utf-8'))
+        self.server.requests.append((self.path, self.headers.get('Transfer-Encoding'), len(chunks), docs))
+        bad = [doc['id'] for doc in docs if 'name' not in doc]
+        if self.path.startswith('/tolerant'):
+            body = {'responseHeader': {'status': 0, 'errors': [
+                {'type': 'ADD', 'id': ident, 'message': 'missing name'} for ident in bad]}}
+            status = 200
+        elif bad:
+            body = {'responseHeader': {'status': 400},
+                    'error': {'msg': 'ERROR: [doc=%s] missing required field: name' % bad[0]}}
+            status = 400
+        else:
+            body = {'responseHeader': {'status': 0}}
+            status = 200
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def documents(count, unnamed=()):
+    for i in range(count):
+        doc = {'id': 'stoparea:%d' % i}
+        if i not in unnamed:
+            doc['name'] = 'Station %d' % i
+        yield doc
+
+
+class StreamingIndexerTest(unittest.TestCase):
+    """
+    Tests for the streaming bulk upload to an update handler
+    """
+
+    def test_stream(self):
+        with StubServer(SolrUpdateHandler) as server:
+            sink = StreamingIndexer(server.url + '/staging/update', {'commitWithin': 1000}, chunk_size=100)
+            sink.consume(documents(50))
+        path, encoding, chunks, docs = server.requests[0]
+        self.assertEqual(encoding, 'chunked')
+        self.assertTrue(chunks > 1)
+        self.assertEqual(docs, list(documents(50)))
+        self.assertIn('commit=true', path)
+        self.assertIn('commitWithin=1000', path)
+        self.assertEqual((sink.indexed, sink.failed, sink.errors), (50, 0, []))
+
+    def test_error_offsets(self):
+        with StubServer(SolrUpdateHandler) as server:
+            sink = StreamingIndexer(server.url + '/staging/update')
+            sink.consume(documents(20, unnamed=[7, 12]))
+        self.assertEqual((sink.indexed, sink.failed), (0, 20))
+        self.assertEqual(sink.errors, [(7, 'stoparea:7', 'ERROR: [doc=stoparea:7] missing required field: name')])
+
+    def test_tolerant_errors(self):
+        with StubServer(SolrUpdateHandler) as server:
+            sink = StreamingIndexer(server.url + '/tolerant/update')
+            sink.consume(documents(20, unnamed=[7, 12]))
+        self.assertEqual((sink.indexed, sink.failed), (18, 2))
+        self.assertEqual([error[:2] for error in sink.errors], [(7, 'stoparea:7'), (12, 'stoparea:12')])
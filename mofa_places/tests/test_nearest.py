@@ -0,0 +1,59 @@
+import math
+import random
+import unittest
+
+from mofa_places.nearest import StationIndex, StationIndexLoader, publish_stations, EARTH_RADIUS
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(math.radians, (lon1, lat1, lon2, lat2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+class DictKV(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+
+class StationIndexTest(unittest.TestCase):
+    """
+    Tests for the nearest stations index
+    """
+
+    def setUp(self):
+        rnd = random.Random(7)
+        self.stations = [(i, 'Station %d' % i, rnd.uniform(5.9, 10.5), rnd.uniform(45.8, 47.8))
+                         for i in range(3000)]
+        self.index = StationIndex(self.stations)
+
+    def brute_force(self, lon, lat):
+        return sorted((haversine(lon, lat, s[2], s[3]), s) for s in self.stations)
+
+    def test_nearest(self):
+        for lon, lat in [(8.540192, 47.378177), (6.142, 46.210), (10.5, 45.8), (12.0, 50.0)]:
+            expected = self.brute_force(lon, lat)[:5]
+            result = self.index.nearest(lon, lat, 5)
+            self.assertEqual([s for _, s in result], [s for _, s in expected])
+            for (distance, _), (expected_distance, _) in zip(result, expected):
+                self.assertAlmostEqual(distance, expected_distance, delta=0.01)
+
+    def test_radius(self):
+        expected = [s for d, s in self.brute_force(8.540192, 47.378177) if d <= 10000]
+        result = self.index.nearest(8.540192, 47.378177, count=1000, radius=10000)
+        self.assertEqual([s for _, s in result], expected)
+        self.assertEqual(self.index.nearest(8.540192, 47.378177, count=2, radius=10000),
+                         result[:2])
+
+    def test_loader(self):
+        kv = DictKV()
+        loader = StationIndexLoader(kv, check_interval=0)
+        self.assertEqual(loader.get(), None)
+        publish_stations(kv, self.stations[:10])
+        index = loader.get()
+        self.assertEqual(len(index.stations), 10)
+        self.assertTrue(loader.get() is index)
+        kv['places.sbb.stations.nearest.version'] = 'new'
+        self.assertFalse(loader.get() is index)
@@ -0,0 +1,95 @@
+import sys
+import unittest
+
+from mofa_places.tests import moxie_stubs
+moxie_stubs.install()
+
+# the flask stub only covers what the transport modules use
+HAS_FLASK = hasattr(sys.modules['flask'], 'Flask')
+if HAS_FLASK:
+    from flask import Flask
+    from mofa_places import representations
+    from mofa_places.representations import HALFoodRepresentation, RepresentationCache
+
+
+class Encoder(object):
+    """ Encoded body of a representation, counting its calls """
+
+    def __init__(self, body):
+        self.body = body
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.body
+
+
+@unittest.skipUnless(HAS_FLASK, "flask isn't installed")
+class RepresentationCacheTest(unittest.TestCase):
+
+    def test_encoded_once(self):
+        cache = RepresentationCache()
+        encode = Encoder(b'{"stations": []}')
+        body, etag = cache.get(('places.stations', '2013-05-23'), encode)
+        self.assertEqual(cache.get(('places.stations', '2013-05-23'), encode), (body, etag))
+        self.assertEqual(body, b'{"stations": []}')
+        self.assertEqual(encode.calls, 1)
+
+    def test_last_updated(self):
+        cache = RepresentationCache()
+        _, etag = cache.get(('places.stations', '2013-05-23'), Encoder(b'{"stations": []}'))
+        encode = Encoder(b'{"stations": [1]}')
+        body, new_etag = cache.get(('places.stations', '2013-05-24'), encode)
+        self.assertEqual(body, b'{"stations": [1]}')
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(encode.calls, 1)
+        self.assertEqual(len(cache.entries), 2)
+
+    def test_max_entries(self):
+        cache = RepresentationCache(max_entries=2)
+        cache.get(('a', 1), Encoder(b'a'))
+        cache.get(('b', 1), Encoder(b'b'))
+        # 'a' is now the most recently used
+        cache.get(('a', 1), Encoder(b'a'))
+        cache.get(('c', 1), Encoder(b'c'))
+        self.assertEqual(list(cache.entries), [('a', 1), ('c', 1)])
+        encode = Encoder(b'b')
+        cache.get(('b', 1), encode)
+        self.assertEqual(encode.calls, 1)
+
+
+@unittest.skipUnless(HAS_FLASK, "flask isn't installed")
+class HALFoodRepresentationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.add_url_rule('/stations', 'stations', lambda: '')
+        self.cache, representations.representations = representations.representations, RepresentationCache()
+
+    def tearDown(self):
+        representations.representations = self.cache
+
+    def representation(self):
+        return HALFoodRepresentation([{'id': 8503000}], "SBB", '2013-05-23', 'stations')
+
+    def test_as_json(self):
+        with self.app.test_request_context('/stations'):
+            response = self.representation().as_json()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'application/json')
+            etag, weak = response.get_etag()
+            self.assertFalse(weak)
+            self.assertIn(b'8503000', response.get_data())
+
+    def test_not_modified(self):
+        with self.app.test_request_context('/stations'):
+            etag, _ = self.representation().as_json().get_etag()
+        representation = self.representation()
+        representation.as_dict = lambda: self.fail("as_dict called for a cached representation")
+        with self.app.test_request_context('/stations', headers={'If-None-Match': '"%s"' % etag}):
+            response = representation.as_json()
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.get_etag(), (etag, False))
+            self.assertEqual(response.get_data(), b'')
+        with self.app.test_request_context('/stations', headers={'If-None-Match': '"other"'}):
+            self.assertEqual(representation.as_json().status_code, 200)
@@ -0,0 +1,75 @@
+import threading
+import time
+import unittest
+
+from mofa_places.transport.resilience import (CircuitBreaker, LatencyTracker, DeadlineExceeded,
+                                              hedged)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """
+    Tests for the circuit breaker of upstream RTI calls
+    """
+
+    def test_breaker(self):
+        now = [1000.0]
+        changes = []
+        breaker = CircuitBreaker(3, 30, on_change=lambda state, trips: changes.append((state, trips)),
+                                 clock=lambda: now[0])
+        for _ in range(2):
+            breaker.failure()
+        breaker.success()
+        for _ in range(3):
+            self.assertTrue(breaker.allow())
+            breaker.failure()
+        self.assertFalse(breaker.allow())
+        now[0] += 30
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        now[0] += 30
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertTrue(breaker.allow())
+        self.assertEqual(changes, [('open', 1), ('half-open', 1), ('open', 2),
+                                   ('half-open', 2), ('closed', 2)])
+
+    def test_percentile(self):
+        tracker = LatencyTracker(window=100, min_samples=10)
+        tracker.add(1.0)
+        self.assertEqual(tracker.percentile(95), None)
+        for i in range(200):
+            tracker.add(i / 100.0)
+        self.assertEqual(tracker.percentile(95), 1.95)
+
+
+class HedgedTest(unittest.TestCase):
+    """
+    Tests for hedged calls with a deadline
+    """
+
+    def test_hedge(self):
+        calls = []
+        lock = threading.Lock()
+
+        def func():
+            with lock:
+                calls.append(1)
+                first = len(calls) == 1
+            time.sleep(1.0 if first else 0.01)
+            return 'first' if first else 'hedge'
+        hedges = []
+        start = time.time()
+        self.assertEqual(hedged(func, 2, 0.05, on_hedge=lambda: hedges.append(1)), 'hedge')
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(hedges, [1])
+
+    def test_deadline(self):
+        start = time.time()
+        self.assertRaises(DeadlineExceeded, hedged, lambda: time.sleep(1), 0.1)
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_error(self):
+        def fail():
+            raise IOError("connection refused")
+        self.assertRaises(IOError, hedged, fail, 1, 0.5)
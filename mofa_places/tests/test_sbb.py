@@ -0,0 +1,120 @@
+import shutil
+import tempfile
+import unittest
+from os.path import join
+
+from mofa_places.tests import moxie_stubs
+moxie_stubs.install()
+
+from mofa_places.importers import sbb
+from mofa_places.importers.sbb import SbbStationImporter
+from mofa_places.importers.store import StationStore
+
+
+def prepare_document(data, search_results, precedence):
+    """ Document with the ids of the results it would be merged with """
+    doc = dict(data)
+    doc['merged'] = [result['id'] for result in search_results.results]
+    return doc
+
+
+class Results(object):
+
+    def __init__(self, results):
+        self.results = results
+
+
+class FakeIndexer(object):
+    """ Index of documents searched by identifier """
+
+    def __init__(self, docs=(), rows=10):
+        self.docs = list(docs)
+        self.rows = rows
+        self.indexed = []
+        self.searches = []
+
+    def index(self, docs, params=None):
+        self.indexed.extend(docs)
+
+    def commit(self):
+        pass
+
+    def search_for_ids(self, key, identifiers, **kwargs):
+        self.searches.append((len(identifiers), kwargs))
+        wanted = set(identifiers)
+        return Results([doc for doc in self.docs if wanted & set(doc[key])][:self.rows])
+
+
+class SbbStationImporterTest(unittest.TestCase):
+    """
+    Tests for the SBB stations importer
+    """
+
+    def setUp(self):
+        self.prepare_document = sbb.prepare_document
+        sbb.prepare_document = prepare_document
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        sbb.prepare_document = self.prepare_document
+        shutil.rmtree(self.tmp)
+
+    def station_db(self, name, stations):
+        path = join(self.tmp, name + '.db')
+        store = StationStore(path)
+        for ident, station_name in stations:
+            store.add({'id': ident, 'name': station_name, 'x': 8.5, 'y': 47.3})
+        store.close()
+        return path
+
+    def run_importer(self, db, checkpoint=None, indexer=None, lookup_batch_size=100):
+        indexer = indexer or FakeIndexer()
+        importer = SbbStationImporter(indexer, 10, db, ['340'], checkpoint=checkpoint,
+                                      lookup_batch_size=lookup_batch_size)
+        importer.run()
+        return importer, indexer
+
+    def test_incremental(self):
+        db = self.station_db('first', [(8503000, u'Z\xfcrich HB'), (8503003, u'Z\xfcrich Stadelhofen'),
+                                       (8503006, u'Z\xfcrich Oerlikon')])
+        first, indexer = self.run_importer(db)
+        self.assertEqual(sorted(first.hashes), ['8503000', '8503003', '8503006'])
+        self.assertEqual(len(indexer.indexed), 3)
+        self.assertEqual(first.removed, [])
+
+        # 8503003 renamed, 8503006 removed, 8503010 added
+        db = self.station_db('second', [(8503000, u'Z\xfcrich HB'), (8503003, u'Stadelhofen'),
+                                        (8503010, u'Z\xfcrich Enge')])
+        second, indexer = self.run_importer(db, checkpoint=first.hashes)
+        self.assertEqual(sorted(doc['id'] for doc in indexer.indexed),
+                         ['stoparea:8503003', 'stoparea:8503010'])
+        self.assertEqual(second.removed, ['8503006'])
+        self.assertEqual(sorted(second.hashes), ['8503000', '8503003', '8503010'])
+        self.assertEqual(second.hashes['8503000'], first.hashes['8503000'])
+        self.assertNotEqual(second.hashes['8503003'], first.hashes['8503003'])
+
+        # nothing changed
+        third, indexer = self.run_importer(db, checkpoint=second.hashes)
+        self.assertEqual((indexer.indexed, third.removed), ([], []))
+
+    def test_search_for_ids(self):
+        stations = [(8503000 + i, u'Station %d' % i) for i in range(30)]
+        db = self.station_db('stations', stations)
+        # documents from other sources sharing identifiers with the stations,
+        # two of them for 8503004
+        existing = [{'id': 'osm:%d' % i, 'identifiers': ['sbb:%d' % (8503000 + i)]}
+                    for i in range(0, 30, 2)]
+        existing.append({'id': 'other:4', 'identifiers': ['8503004']})
+        expected = {}
+        for ident, name in stations:
+            expected['stoparea:%d' % ident] = [doc['id'] for doc in existing
+                                               if set(doc['identifiers']) & set([str(ident), 'sbb:%d' % ident])]
+
+        for lookup_batch_size in (1, 4, 100):
+            importer, indexer = self.run_importer(db, indexer=FakeIndexer(existing),
+                                                  lookup_batch_size=lookup_batch_size)
+            self.assertEqual(dict((doc['id'], doc['merged']) for doc in indexer.indexed), expected)
+        self.assertEqual(expected['stoparea:8503004'], ['osm:4', 'other:4'])
+        # the batched search of 60 identifiers was truncated and split
+        self.assertEqual(indexer.searches[0][0], 60)
+        self.assertTrue(len(indexer.searches) > 1)
@@ -0,0 +1,167 @@
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+
+import requests
+
+from mofa_places.tests import moxie_stubs
+moxie_stubs.install()
+
+from mofa_places.domain import Departure
+from mofa_places.transport import sbb
+from mofa_places.transport.cache import BoardCache
+from mofa_places.transport.resilience import CircuitBreaker
+from mofa_places.transport.sbb import SbbRtiProvider
+
+
+class DictKV(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+
+class RecordingStatsd(object):
+
+    def __init__(self):
+        self.timers = []
+        self.counters = []
+
+    @contextmanager
+    def timer(self, name):
+        try:
+            yield
+        finally:
+            self.timers.append(name)
+
+    def incr(self, name):
+        self.counters.append(name)
+
+    def gauge(self, name, value):
+        pass
+
+
+class Doc(object):
+
+    def __init__(self, *identifiers):
+        self.identifiers = identifiers
+
+
+STATIONBOARD = b"""{"station": {"id": "8503000", "name": "Z\\u00fcrich HB"},
+ "stationboard": [
+  {"stop": {"station": {"id": "8503000", "name": "Z\\u00fcrich HB"},
+            "arrival": null, "departure": "2013-05-23T12:02:00+0200",
+            "departureTimestamp": 1369303320, "delay": 3, "platform": "7",
+            "prognosis": {"platform": null, "departure": "2013-05-23T12:05:00+0200"}},
+   "name": "IC 2", "category": "IC", "number": "2", "operator": "SBB",
+   "to": "Lugano", "passList": []},
+  {"stop": {"departure": "2013-05-23T12:04:00+0200", "delay": null, "platform": null},
+   "name": "S 5", "category": "S", "number": "5", "operator": null,
+   "to": "Pf\\u00e4ffikon SZ"}
+ ]}"""
+
+
+class Session(object):
+    """ requests session answering every request with content """
+
+    def __init__(self, content):
+        self.content = content
+
+    def get(self, url, params=None, timeout=None):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = self.content
+        return response
+
+
+def board(sbb_code):
+    return [Departure('2013-05-23T12:00:00+0200', None, '3', 'IC', '1', 'to %s' % sbb_code, 'SBB')], []
+
+
+class SbbRtiProviderTest(unittest.TestCase):
+    """
+    Tests for the SBB RTI provider, upstream replaced by fetch functions
+    """
+
+    def setUp(self):
+        self.kv_store, sbb.kv_store = sbb.kv_store, DictKV()
+        self.statsd, sbb.statsd = sbb.statsd, RecordingStatsd()
+        self.now = [1000.0]
+        self.provider = SbbRtiProvider(None, hedge_percentile=None, breaker_threshold=1)
+        self.provider.boards = BoardCache(ttl=15, clock=lambda: self.now[0])
+        self.provider.breaker = CircuitBreaker(1, 30, clock=lambda: self.now[0])
+
+    def tearDown(self):
+        sbb.kv_store = self.kv_store
+        sbb.statsd = self.statsd
+
+    def test_stale_board_while_breaker_open(self):
+        self.provider.fetch_departure_board = lambda sbb_code, limit: board(sbb_code)
+        self.assertEqual(self.provider.get_departure_board('8503000'), board('8503000'))
+        self.now[0] += 20
+        self.assertEqual(self.provider.get_departure_board('8500010'), board('8500010'))
+
+        def unavailable(sbb_code, limit):
+            raise requests.ConnectionError("upstream down")
+        self.provider.fetch_departure_board = unavailable
+        self.now[0] += 20
+        # the failure opens the circuit, the expired board is served
+        self.assertEqual(self.provider.get_departure_board('8503000'), board('8503000'))
+        self.assertEqual(self.provider.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.provider.get_departure_board('8500010'), board('8500010'))
+        self.assertEqual(sbb.statsd.counters.count('transport.providers.sbb.breaker.rejected'), 1)
+        # no board at all for this one
+        self.assertRaises(Exception, self.provider.get_departure_board, '8507000')
+
+    def test_invoke_batch(self):
+        fetched = []
+        lock = threading.Lock()
+
+        def fetch(sbb_code, limit):
+            with lock:
+                fetched.append(sbb_code)
+            if sbb_code == '8503000':
+                # slowest first, results stay in the order of the documents
+                time.sleep(0.2)
+            if sbb_code == '0000000':
+                response = requests.Response()
+                response.status_code = 404
+                raise requests.HTTPError("not found", response=response)
+            return board(sbb_code)
+        self.provider.fetch_departure_board = fetch
+        docs = [Doc('stoparea:8503000', 'sbb:8503000'), Doc('sbb:0000000'), Doc('sbb:8500010')]
+        results = self.provider.invoke_batch(docs, 'rail-departures')
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0][0], [service._asdict() for service in board('8503000')[0]])
+        self.assertEqual(results[0][2:], ('rail-departures', 'Departures'))
+        self.assertEqual(results[1], None)
+        self.assertEqual(results[2][0][0]['to'], 'to 8500010')
+        self.assertEqual(sorted(fetched), ['0000000', '8500010', '8503000'])
+        # a timer for each station and one for the batch
+        self.assertEqual(sorted(sbb.statsd.timers),
+                         ['transport.providers.sbb.rti'] * 3 + ['transport.providers.sbb.rti.batch'])
+        self.assertEqual(sbb.statsd.timers[-1], 'transport.providers.sbb.rti.batch')
+        # a bad station doesn't count as an upstream failure
+        self.assertEqual(self.provider.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_invoke_batch_rti_types(self):
+        self.provider.fetch_departure_board = lambda sbb_code, limit: board(sbb_code)
+        results = self.provider.invoke_batch([Doc('sbb:8503000'), Doc('sbb:8500010')],
+                                             ['rail-departures', 'rail-arrivals'])
+        self.assertEqual(len(results[0][0]), 1)
+        self.assertEqual(results[1], ([], [], 'rail-arrivals', 'Arrivals'))
+
+    def test_invoke_stationboard(self):
+        self.provider.session = Session(STATIONBOARD)
+        services, messages, rti_type, title = self.provider.invoke(Doc('sbb:8503000'), 'rail-departures')
+        self.assertEqual(services, [
+            {'departure': '2013-05-23T12:02:00+0200', 'delay': 3, 'platform': '7',
+             'category': 'IC', 'number': '2', 'to': 'Lugano', 'operator': 'SBB'},
+            {'departure': '2013-05-23T12:04:00+0200', 'delay': None, 'platform': None,
+             'category': 'S', 'number': '5', 'to': u'Pf\xe4ffikon SZ', 'operator': 'unknown'},
+        ])
+        self.assertEqual((messages, rti_type, title), ([], 'rail-departures', 'Departures'))
+
+    def test_parse_departures_empty(self):
+        self.assertEqual(sbb.parse_departures(b'{"stationboard": null}'), [])
+        self.assertEqual(sbb.parse_departures(b'{}'), [])
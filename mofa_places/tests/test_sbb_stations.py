@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import unittest
+from os.path import join, dirname
+
+try:
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from urlparse import urlparse, parse_qs
+
+from mofa_places.importers.sbb_stations import Stations
+from mofa_places.tests.stub_server import StubServer, QuietHandler
+
+STATIONS_DIR = join(dirname(__file__), 'data', 'stations')
+
+
+class StationboardHandler(QuietHandler):
+    """ Serve the "stations near" fixtures, failing once for each page
+
+    Pages of the stations listed in server.missing are not found, pages
+    are revalidated with their ETag.
+    """
+
+    def do_GET(self):
+        station = parse_qs(urlparse(self.path).query)['input'][0]
+        self.server.requests.append(station)
+        path = join(STATIONS_DIR, '%s.html' % station)
+        if station in getattr(self.server, 'missing', ()):
+            self.send_response(404)
+            self.end_headers()
+        elif self.server.requests.count(station) == 1:
+            self.send_response(503)
+            self.end_headers()
+        elif self.headers.get('If-None-Match') == '"%s"' % station:
+            self.send_response(304)
+            self.end_headers()
+        elif os.path.exists(path):
+            with open(path, 'rb') as f:
+                content = f.read()
+            self.send_response(200)
+            self.send_header('ETag', '"%s"' % station)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+
+class StationsCrawlTest(unittest.TestCase):
+    """
+    Tests for the SBB stations crawler against a stub stationboard server
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def crawl(self, name, concurrency, missing=(), db=None, cache_ttl=None, processes=0,
+              clean_geo=False):
+        with StubServer(StationboardHandler) as server:
+            server.httpd.missing = missing
+            stations = Stations(db=join(self.tmp, (db or name) + '.db'), url=server.url,
+                                cache_dir=join(self.tmp, name), concurrency=concurrency,
+                                rate=1000, cache_ttl=cache_ttl, processes=processes)
+            stations.crawler.backoff = 0.01
+            stations.fetch()
+            if clean_geo:
+                stations.clean_geo()
+            stations.crawler.close()
+            stations.extractor.close()
+            rows = stations.db.execute("SELECT id, name FROM station ORDER BY id").fetchall()
+        return [(row['id'], row['name']) for row in rows], server.requests
+
+    def test_fetch(self):
+        sequential, _ = self.crawl('sequential', 1)
+        concurrent, requests = self.crawl('concurrent', 4, processes=2)
+        self.assertEqual(concurrent, sequential)
+        # stations abroad are crawled too
+        self.assertEqual([ident for ident, name in concurrent],
+                         [8000096, 8503000, 8503003, 8503006, 8503010, 8503016])
+        self.assertEqual(dict(concurrent)[8503016], u'Z\xfcrich Flughafen')
+        # each page is retried once after a 503
+        self.assertEqual(sorted(set(requests)), ['8000096', '8503000', '8503003', '8503006',
+                                                 '8503010', '8503016'])
+        self.assertEqual(len(requests), 12)
+
+    def test_clean_geo(self):
+        stations, _ = self.crawl('clean', 2, clean_geo=True)
+        self.assertEqual([ident for ident, name in stations],
+                         [8503000, 8503003, 8503006, 8503010, 8503016])
+
+    def test_resume(self):
+        interrupted, requests = self.crawl('resume', 2, missing=('8503006',))
+        self.assertEqual([ident for ident, name in interrupted],
+                         [8503000, 8503003, 8503006, 8503010])
+        resumed, requests = self.crawl('resume', 2)
+        self.assertEqual([ident for ident, name in resumed],
+                         [8000096, 8503000, 8503003, 8503006, 8503010, 8503016])
+        # only the frontier left by the first crawl is expanded
+        self.assertEqual(sorted(set(requests)), ['8000096', '8503006', '8503016'])
+
+    def test_cache(self):
+        crawled, requests = self.crawl('cache', 2)
+        cached, requests = self.crawl('cache', 2, db='cached')
+        self.assertEqual(cached, crawled)
+        self.assertEqual(requests, [])
+        # stale pages are revalidated (each page fails once with a 503 first)
+        revalidated, requests = self.crawl('cache', 2, db='revalidated', cache_ttl=0)
+        self.assertEqual(revalidated, crawled)
+        self.assertEqual(len(requests), 12)
+
+    def test_foreign_stations(self):
+        with open(join(STATIONS_DIR, '8503000.html'), 'rb') as f:
+            content = f.read()
+        # Stuttgart instead of Zurich Stadelhofen, crawled like the others
+        content = content.replace(b'MapLocation.X=8548283&amp;MapLocation.Y=47366854',
+                                  b'MapLocation.X=9181636&amp;MapLocation.Y=48784081')
+        stations = Stations(db=join(self.tmp, 'foreign.db'), cache_dir=join(self.tmp, 'foreign'))
+        found = stations.stationsFromPage('8503000', content)
+        stations.crawler.close()
+        self.assertEqual([s['id'] for s in found], [8503000, 8503003, 8503010])
+        self.assertEqual(found[1]['y'], 48.784081)
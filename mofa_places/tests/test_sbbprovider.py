@@ -0,0 +1,47 @@
+import threading
+import unittest
+from os.path import join, dirname
+
+from mofa_places.importers.stationboard import iter_stations, parse_stations
+from mofa_places.providers.sbbprovider import DefaultSbbProvider
+from mofa_places.tests.stub_server import StubServer, QuietHandler
+
+with open(join(dirname(__file__), 'data', 'stations', '8503000.html'), 'rb') as f:
+    PAGE = f.read()
+
+
+class SlowPageHandler(QuietHandler):
+    """ Send the end of the page once server.resume is set """
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.end_headers()
+        middle = PAGE.index(b'8503003', PAGE.index(b'zebra-row-1'))
+        self.wfile.write(PAGE[:middle])
+        self.wfile.flush()
+        self.server.resume.wait(5)
+        self.wfile.write(PAGE[middle:])
+
+
+class DefaultSbbProviderTest(unittest.TestCase):
+    """
+    Tests for the streaming SBB stations provider
+    """
+
+    def test_iter_stations(self):
+        chunks = [PAGE[i:i + 64] for i in range(0, len(PAGE), 64)]
+        self.assertEqual(list(iter_stations(chunks)), parse_stations(PAGE))
+
+    def test_import_data(self):
+        with StubServer(SlowPageHandler) as server:
+            server.httpd.resume = threading.Event()
+            provider = DefaultSbbProvider(url=server.url, chunk_size=256)
+            stations = provider.import_data()
+            # available before the end of the page has been sent
+            first = next(stations)
+            server.httpd.resume.set()
+            rest = list(stations)
+        self.assertEqual(first.as_dict(), {'id': 8503000, 'name': u'Z\xfcrich HB',
+                                           'x': 8.540192, 'y': 47.378177})
+        self.assertEqual([s.id for s in rest], [8503003, 8503010])
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import io
+import shutil
+import tempfile
+import unittest
+import zipfile
+from os.path import join
+
+from mofa_places.importers.store import StationStore
+from mofa_places.importers.stops import StopsImporter, build_station_db, read_stops
+
+GTFS_STOPS = u"""stop_id,stop_name,stop_lat,stop_lon,location_type,parent_station
+Parent8503000,Zürich HB,47.378177,8.540192,1,
+8503000:0:3,Zürich HB,47.378100,8.540100,0,Parent8503000
+8503006,Zürich Oerlikon,47.411528,8.544115,,
+8301047,Como S. Giovanni,45.808985,9.072434,1,
+"""
+
+SBB_STOPS = u"""BPUIC;BEZEICHNUNG_OFFIZIELL;E_WGS84;N_WGS84
+8500010;Basel SBB;7.589563;47.547412
+8503000;Zürich HB;8.540192;47.378177
+8503999;Nowhere;;
+"""
+
+
+class StopsImporterTest(unittest.TestCase):
+    """
+    Tests for the import of stop lists in the station DB
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = join(self.tmp, 'stations.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_read_gtfs(self):
+        stops = list(read_stops(io.StringIO(GTFS_STOPS)))
+        self.assertEqual([s['id'] for s in stops], [8503000, 8503006, 8301047])
+        self.assertEqual(stops[0], {'id': 8503000, 'name': u'Zürich HB', 'x': 8.540192, 'y': 47.378177})
+
+    def test_read_sbb(self):
+        stops = list(read_stops(io.StringIO(SBB_STOPS)))
+        self.assertEqual([(s['id'], s['name']) for s in stops], [(8500010, u'Basel SBB'), (8503000, u'Zürich HB')])
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, list, read_stops(io.StringIO(u"id,name\n1,a\n")))
+
+    def test_import(self):
+        store = StationStore(self.path)
+        importer = StopsImporter(store, batch_size=2)
+        importer.run(io.StringIO(GTFS_STOPS))
+        self.assertEqual((importer.imported, importer.outside), (2, 1))
+        ids = [s['id'] for s in store.conn.execute("SELECT id FROM station ORDER BY id").fetchall()]
+        self.assertEqual(ids, [8503000, 8503006])
+        store.close()
+
+    def test_build_from_gtfs_feed(self):
+        feed = join(self.tmp, 'gtfs.zip')
+        with zipfile.ZipFile(feed, 'w') as f:
+            f.writestr('stops.txt', GTFS_STOPS.encode('utf-8'))
+            f.writestr('routes.txt', b'route_id\n')
+        importer = build_station_db(feed, self.path)
+        self.assertEqual(importer.imported, 2)
+        store = StationStore(self.path)
+        self.assertEqual(len(store.within(8.4, 47.3, 8.7, 47.5)), 2)
+        store.close()
+
+    def test_build_from_sbb_csv(self):
+        path = join(self.tmp, 'stations.csv')
+        with open(path, 'wb') as f:
+            f.write(b'\xef\xbb\xbf' + SBB_STOPS.encode('utf-8')
+                    + u'8504221;Neuch\xe2tel;6.935567;46.996601\n'.encode('utf-8'))
+        importer = build_station_db(path, self.path)
+        self.assertEqual(importer.imported, 3)
+        store = StationStore(self.path)
+        names = [s['name'] for s in store.conn.execute("SELECT name FROM station ORDER BY id").fetchall()]
+        self.assertEqual(names, [u'Basel SBB', u'Z\xfcrich HB', u'Neuch\xe2tel'])
+        store.close()
@@ -0,0 +1,113 @@
+import bz2
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import zipfile
+from os.path import join
+
+from mofa_places.importers.store import StationStore, connect_readonly, extract_database
+
+
+class StationStoreTest(unittest.TestCase):
+    """
+    Tests for the SQLite station store and its R*Tree table
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = join(self.tmp, 'stations.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_store(self):
+        store = StationStore(self.path, batch_size=2)
+        self.assertEqual(store.conn.execute("PRAGMA journal_mode").fetchone()['journal_mode'], 'wal')
+        store.add({'id': 8503000, 'name': u'Z\xfcrich HB', 'x': 8.540192, 'y': 47.378177})
+        store.add({'id': 8503006, 'name': u'Z\xfcrich Oerlikon', 'x': 8.544115, 'y': 47.411528})
+        store.add({'id': 8500010, 'name': u'Basel SBB', 'x': 7.589563, 'y': 47.547412})
+        store.commit()
+        zurich = (8.4, 47.3, 8.7, 47.5)
+        self.assertEqual(sorted(s['id'] for s in store.within(*zurich)), [8503000, 8503006])
+
+        # update (moved out of the box) and delete are reflected in the R*Tree
+        store.add({'id': 8503006, 'name': u'Z\xfcrich Oerlikon', 'x': 9.0, 'y': 47.411528})
+        store.delete([8503000])
+        store.commit()
+        self.assertEqual(store.within(*zurich), [])
+        self.assertEqual(store.conn.execute("SELECT COUNT(*) AS n FROM station").fetchone()['n'], 2)
+        store.close()
+
+    def test_within_edges(self):
+        store = StationStore(self.path)
+        store.add({'id': 8503000, 'name': u'Z\xfcrich HB', 'x': 8.540192, 'y': 47.378177})
+        store.commit()
+        for box in [(8.540192 - 1e-6, 47.378177 - 1e-6, 8.540192 + 1e-6, 47.378177 + 1e-6),
+                    (8.540192, 47.378177, 8.540192, 47.378177)]:
+            self.assertEqual([s['id'] for s in store.within(*box)], [8503000])
+        self.assertEqual(store.within(8.540193, 47.378177, 8.6, 47.4), [])
+        store.spatial = False
+        self.assertEqual(store.within(8.540193, 47.378177, 8.6, 47.4), [])
+        store.close()
+
+    def test_existing_database(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE station (id INTEGER PRIMARY KEY, name VARCHAR(255), "
+                     "x REAL, y REAL, type VARCHAR(25), modified TEXT)")
+        conn.execute("INSERT INTO station (id, name, x, y) VALUES (8503000, 'HB', 8.540192, 47.378177)")
+        conn.commit()
+        conn.close()
+        store = StationStore(self.path)
+        self.assertEqual([s['id'] for s in store.within(8.4, 47.3, 8.7, 47.5)], [8503000])
+        store.close()
+
+
+class StationDatabaseTest(unittest.TestCase):
+    """
+    Tests for reading (compressed) station databases
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = join(self.tmp, 'stations.db')
+        store = StationStore(self.path)
+        store.add({'id': 8503000, 'name': u'Z\xfcrich HB', 'x': 8.540192, 'y': 47.378177})
+        store.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def count(self, path):
+        conn = connect_readonly(path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM station").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_readonly(self):
+        conn = connect_readonly(self.path)
+        self.assertRaises(sqlite3.OperationalError, conn.execute, "DELETE FROM station")
+        conn.close()
+        self.assertEqual(self.count(self.path), 1)
+
+    def test_uncompressed(self):
+        self.assertEqual(extract_database(self.path), self.path)
+
+    def test_bz2(self):
+        archive = join(self.tmp, 'stations.bz2')
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with open(archive, 'wb') as f:
+            f.write(bz2.compress(data))
+        db = extract_database(archive)
+        self.assertEqual(db, archive + '.db')
+        self.assertEqual(self.count(db), 1)
+        # already extracted
+        self.assertEqual(extract_database(archive), db)
+
+    def test_zip(self):
+        archive = join(self.tmp, 'stations.zip')
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as f:
+            f.write(self.path, 'stations.db')
+        self.assertEqual(self.count(extract_database(archive)), 1)
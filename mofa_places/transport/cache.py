@@ -0,0 +1,146 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class BoardCache(object):
+    """ In-memory cache of boards with a short time to live
+
+    Concurrent misses for the same key are coalesced: the first caller
+    fetches the value, the others wait for its result. Errors are not
+    cached. At most max_entries are kept, the oldest (set first) are
+    evicted first.
+    """
+
+    def __init__(self, ttl=15, max_entries=1000, clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = OrderedDict()    # key -> (expiry time, value), oldest first
+        self.inflight = {}      # key -> _Call
+        self.lock = threading.Lock()
+
+    def get(self, key, fetch):
+        """ Get the value of key, calling fetch() to get it if needed """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                return entry[1]
+            call = self.inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self.inflight[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fetch()
+            self.set(key, call.value)
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            call.event.set()
+
+    def stale(self, key):
+        """ Value of key even if it expired, None if there isn't any """
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry[1]
+        return None
+
+    def set(self, key, value):
+        with self.lock:
+            now = self.clock()
+            self.entries.pop(key, None)
+            # expired entries are kept for stale(), until there's no room left
+            while len(self.entries) >= self.max_entries:
+                self.entries.popitem(last=False)
+            self.entries[key] = (now + self.ttl, value)
+
+
+class HitCounter(object):
+    """ Count hits in memory and add them to the counts kept in kv
+
+    Counts are added at most every flush_interval seconds. Processes
+    flushing at the same time may lose some hits, counts are only used to
+    find the most requested boards.
+    """
+
+    def __init__(self, kv, key, flush_interval=60, clock=time.time):
+        self.kv = kv
+        self.key = key
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.counts = {}
+        self.flushed = clock()
+        self.lock = threading.Lock()
+
+    def hit(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if self.clock() - self.flushed < self.flush_interval:
+                return
+            counts, self.counts = self.counts, {}
+            self.flushed = self.clock()
+        self.flush(counts)
+
+    def flush(self, counts):
+        try:
+            stored = json.loads(self.kv.get(self.key) or '{}')
+            for name, count in counts.items():
+                stored[name] = stored.get(name, 0) + count
+            self.kv.set(self.key, json.dumps(stored))
+        except Exception:
+            logger.warning("Couldn't save hits in %s", self.key, exc_info=True)
+
+
+def top_hits(kv, key, count, decay=0.5):
+    """ Names with the most hits counted by HitCounter
+
+    Counts are multiplied by decay (and dropped under 1) so the most
+    recent hits weigh more. Names with the same count are sorted by name.
+    """
+    stored = json.loads(kv.get(key) or '{}')
+    top = sorted(stored, key=lambda name: (-stored[name], name))[:count]
+    decayed = dict((name, hits * decay) for name, hits in stored.items() if hits * decay >= 1)
+    kv.set(key, json.dumps(decayed))
+    return top
+
+
+def save_board(kv, key, board):
+    """ Store a board (services, messages) fetched now in kv """
+    services, messages = board
+    kv.set(key, json.dumps({'fetched': time.time(),
+                            'services': services,
+                            'messages': messages}))
+
+
+def load_board(kv, key, max_age):
+    """ Board stored in kv if fetched less than max_age seconds ago """
+    value = kv.get(key)
+    if value is None:
+        return None
+    board = json.loads(value)
+    if time.time() - board['fetched'] > max_age:
+        return None
+    return board['services'], board['messages']
@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from collections import deque
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    """ Stop calling an unhealthy upstream for a while
+
+    The circuit opens after failure_threshold consecutive failures: calls
+    are not allowed for reset_timeout seconds, then one trial call is
+    allowed (half open) which closes the circuit if it succeeds.
+    on_change(state, trips) is called on every change of state.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, on_change=None, clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_change = on_change
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self.opened >= self.reset_timeout:
+                self._change(self.HALF_OPEN)
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                self._change(self.CLOSED)
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED
+                                                and self.failures >= self.failure_threshold):
+                self.opened = self.clock()
+                self.trips += 1
+                self._change(self.OPEN)
+
+    def _change(self, state):
+        self.state = state
+        logger.info("Circuit %s", state)
+        if self.on_change:
+            self.on_change(state, self.trips)
+
+
+class LatencyTracker(object):
+    """ Latencies of the last window calls """
+
+    def __init__(self, window=200, min_samples=20):
+        self.latencies = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def add(self, latency):
+        self.latencies.append(latency)
+
+    def percentile(self, percent):
+        """ Latency under which percent % of the calls completed, None
+        until min_samples calls have been measured
+        """
+        if len(self.latencies) < self.min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100.0))]
+
+
+def hedged(func, deadline, hedge_after=None, on_hedge=None):
+    """ Call func in a thread and wait at most deadline seconds
+
+    If hedge_after is given and func didn't return after hedge_after
+    seconds, func is called a second time in parallel and the first
+    successful result is returned. func should give up by itself after
+    deadline seconds (e.g. with a timeout), threads can't be interrupted.
+
+    :raise DeadlineExceeded: no result before the deadline
+    """
+    results = Queue()
+
+    def call():
+        try:
+            results.put((True, func()))
+        except Exception as e:
+            results.put((False, e))
+
+    def start():
+        thread = threading.Thread(target=call)
+        thread.daemon = True
+        thread.start()
+
+    end = time.time() + deadline
+    start()
+    pending = 1
+    hedge_at = time.time() + hedge_after if hedge_after is not None else None
+    error = None
+    while pending:
+        now = time.time()
+        if now >= end:
+            break
+        wait = end - now
+        if hedge_at is not None:
+            wait = min(wait, max(hedge_at - now, 0))
+        try:
+            ok, value = results.get(timeout=wait)
+        except Empty:
+            if hedge_at is not None and time.time() >= hedge_at:
+                hedge_at = None
+                pending += 1
+                if on_hedge:
+                    on_hedge()
+                start()
+            continue
+        pending -= 1
+        if ok:
+            return value
+        error = value
+    if error is not None and not pending:
+        # all calls failed before the deadline
+        raise error
+    raise DeadlineExceeded("No result after %.1fs" % deadline)
@@ -1,16 +1,69 @@
 import logging
+import threading
+import time
 import requests
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
 
 import json
+from flask import current_app, copy_current_request_context, has_app_context, has_request_context
+from moxie.core.kv import kv_store
 from moxie.core.metrics import statsd
 from moxie.transport.providers import TransportRTIProvider
 from moxie.transport.providers.ldb import override_loglevel
 
+from mofa_places.domain import Departure
+from mofa_places.transport.cache import BoardCache, HitCounter, load_board
+from mofa_places.transport.resilience import CircuitBreaker, CircuitOpen, LatencyTracker, hedged
+
 logger = logging.getLogger(__name__)
 
-OPERATOR_KEY = "title"
 UNKNOWN_OPERATOR = "unknown"
 
+# requests per "sbb_code:limit", to find the boards worth prefetching
+HITS_KEY = 'places.sbb.rti.hits'
+
+
+def board_key(sbb_code, limit):
+    """ Key of a board prefetched in the KV store """
+    return 'places.sbb.rti.board.%s.%s' % (sbb_code, limit)
+
+
+def parse_departures(content):
+    """ Departures of a stationboard response (bytes)
+
+    Only the fields of Departure are kept from each entry of the
+    stationboard (see mofa_places.domain), the other fields of its stop
+    (station, prognosis, departureTimestamp...) are dropped.
+    """
+    result = json.loads(content)
+    departures = []
+    for item in result.get('stationboard') or []:
+        stop = item.get('stop') or {}
+        departures.append(Departure(stop.get('departure'), stop.get('delay'),
+                                    stop.get('platform'), item.get('category'),
+                                    item.get('number'), item.get('to'),
+                                    item.get('operator') or UNKNOWN_OPERATOR))
+    return departures
+
+
+def in_caller_context(func):
+    """ Wrap func to run it from another thread in the request (or app)
+    context of the caller, which moxie's services (kv_store, statsd...)
+    are bound to
+    """
+    if has_request_context():
+        return copy_current_request_context(func)
+    if has_app_context():
+        app = current_app._get_current_object()
+
+        def wrapper(*args, **kwargs):
+            with app.app_context():
+                return func(*args, **kwargs)
+        return wrapper
+    return func
+
+
 class SbbRtiProvider(TransportRTIProvider):
     """
     """
@@ -22,9 +75,36 @@ class SbbRtiProvider(TransportRTIProvider):
     provides = {'rail-departures': "Departures",
                 'rail-arrivals': "Arrivals"}
 
-    def __init__(self, url, max_services=15):
+    def __init__(self, url, max_services=15, timeout=5, cache_ttl=15, pool_size=10,
+                 batch_workers=8, prefetch_max_age=60, hedge_percentile=95,
+                 breaker_threshold=5, breaker_reset=30):
         self.url = url
         self._max_services = max_services
+        # deadline (seconds) of a board request, hedged request included
+        self.timeout = timeout
+        # a second request is sent when the first one is slower than
+        # hedge_percentile % of the recent requests (None to disable)
+        self.hedge_percentile = hedge_percentile
+        self.latencies = LatencyTracker()
+        # after breaker_threshold consecutive failures upstream isn't
+        # called for breaker_reset seconds, last known boards are served
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset,
+                                      on_change=self._breaker_changed)
+        # keep-alive connections shared by all requests of the provider
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # boards by (sbb_code, limit), fetched once for concurrent requests
+        self.boards = BoardCache(ttl=cache_ttl)
+        # threads fetching the boards of invoke_batch, started on first use
+        self.batch_workers = batch_workers
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # boards prefetched (see tasks.prefetch_departure_boards) less than
+        # prefetch_max_age seconds ago are served without fetching them
+        self.prefetch_max_age = prefetch_max_age
+        self.hits = HitCounter(kv_store, HITS_KEY)
 
     def handles(self, doc, rti_type=None):
         if rti_type and rti_type not in self.provides:
@@ -44,19 +124,125 @@ class SbbRtiProvider(TransportRTIProvider):
                     elif rti_type == 'rail-arrivals':
                         services, messages = self.get_arrival_board(sbb_code)
                 title = self.provides.get(rti_type)
+                services = [service._asdict() for service in services]
                 return services, messages, rti_type, title
 
-    def get_departure_board(self, sbb_code):
+    def invoke_batch(self, docs, rti_types):
+        """ Invoke the provider for several documents concurrently
+
+        :param docs: documents
+        :param rti_types: RTI type for all documents, or list of RTI types
+                          (one per document)
+        :return: list of the results of invoke in the order of docs, None
+                 for the documents which failed
+        """
+        if isinstance(rti_types, (list, tuple)):
+            calls = list(zip(docs, rti_types))
+        else:
+            calls = [(doc, rti_types) for doc in docs]
+
+        def call(args):
+            doc, rti_type = args
+            try:
+                return self.invoke(doc, rti_type)
+            except Exception:
+                logger.warning("RTI failed for %s", doc.identifiers, exc_info=True)
+                return None
+
+        # each call gets its own copy of the context of the caller
+        calls = [(in_caller_context(call), args) for args in calls]
+        with statsd.timer('transport.providers.sbb.rti.batch'):
+            return self.pool().map(lambda c: c[0](c[1]), calls)
+
+    def pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.batch_workers)
+            return self._pool
+
+    def get_departure_board(self, sbb_code, limit=None):
+        limit = limit or self._max_services
+        self.hits.hit('%s:%s' % (sbb_code, limit))
+        return self.boards.get((sbb_code, limit),
+                               lambda: self._departure_board(sbb_code, limit))
+
+    def _departure_board(self, sbb_code, limit):
+        try:
+            board = load_board(kv_store, board_key(sbb_code, limit), self.prefetch_max_age)
+        except Exception:
+            logger.warning("Couldn't load prefetched board of %s", sbb_code, exc_info=True)
+            board = None
+        if board is not None:
+            services, messages = board
+            return [Departure(*service) for service in services], messages
+
+        if not self.breaker.allow():
+            statsd.incr('transport.providers.sbb.breaker.rejected')
+            return self._last_departure_board(sbb_code, limit, CircuitOpen("SBB RTI unavailable"))
+        try:
+            board = self._fetch_hedged(sbb_code, limit)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code < 500:
+                # bad request for this station, upstream is fine
+                self.breaker.success()
+                raise
+            self.breaker.failure()
+            return self._last_departure_board(sbb_code, limit, e)
+        except Exception as e:
+            self.breaker.failure()
+            return self._last_departure_board(sbb_code, limit, e)
+        self.breaker.success()
+        return board
+
+    def _fetch_hedged(self, sbb_code, limit):
+        hedge_after = None
+        if self.hedge_percentile is not None:
+            hedge_after = self.latencies.percentile(self.hedge_percentile)
+        start = time.time()
+        try:
+            board = hedged(lambda: self.fetch_departure_board(sbb_code, limit),
+                           self.timeout, hedge_after,
+                           on_hedge=lambda: statsd.incr('transport.providers.sbb.hedged'))
+        except Exception:
+            statsd.incr('transport.providers.sbb.failed')
+            raise
+        self.latencies.add(time.time() - start)
+        return board
+
+    def _last_departure_board(self, sbb_code, limit, error):
+        """ Last board known for a station, even expired, when upstream
+        can't be used; raise error if there isn't any
+        """
+        board = self.boards.stale((sbb_code, limit))
+        if board is None:
+            try:
+                board = load_board(kv_store, board_key(sbb_code, limit), float('inf'))
+                if board is not None:
+                    services, messages = board
+                    board = [Departure(*service) for service in services], messages
+            except Exception:
+                logger.warning("Couldn't load prefetched board of %s", sbb_code, exc_info=True)
+        if board is None:
+            raise error
+        statsd.incr('transport.providers.sbb.stale')
+        return board
+
+    def _breaker_changed(self, state, trips):
+        statsd.gauge('transport.providers.sbb.breaker.open',
+                     0 if state == CircuitBreaker.CLOSED else 1)
+        if state == CircuitBreaker.OPEN:
+            statsd.incr('transport.providers.sbb.breaker.trips')
+            logger.warning("SBB RTI circuit opened (%d trips)", trips)
+
+    def fetch_departure_board(self, sbb_code, limit):
+        """ Get a departure board from upstream (no cache) """
         with override_loglevel('WARNING'):
-            resp = requests.get(self.STATIONBOARD,
-                                params={'limit': self._max_services,
-                                        'id': sbb_code})
-            result = json.loads(resp.text)
-            messages = []
-            services = [item['stop'] for item in result.get('stationboard', '')]
-            import sys
-            print >> sys.stderr, services
-            return services, messages
+            resp = self.session.get(self.STATIONBOARD,
+                                    params={'limit': limit,
+                                            'id': sbb_code},
+                                    timeout=self.timeout)
+            resp.raise_for_status()
+            return parse_departures(resp.content), []
 
     def get_arrival_board(self, crs):
         with override_loglevel('WARNING'):